@@ -2,17 +2,53 @@ from django.contrib import admin
 from django.http import HttpResponseRedirect
 from django.shortcuts import reverse
 from django.templatetags.static import static
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.utils.http import url_has_allowed_host_and_scheme
 
+from locations.geocoding import request_location
+
+from .candidates import update_order_candidates
 from .models import (
     Order,
     OrderProduct,
     Product,
     ProductCategory,
     Restaurant,
+    RestaurantAssignment,
     RestaurantMenuItem,
 )
+from .thumbnails import get_image_srcsets
+
+
+def render_image_preview(image, image_variants, height):
+    # Lets the browser pick the smallest variant that fits the preview
+    srcsets = get_image_srcsets(image, image_variants)
+    if not srcsets:
+        return format_html(
+            '<img src="{src}" style="max-height: {height}px;"/>',
+            src=image.url,
+            height=height,
+        )
+
+    sizes = f"{round(height * image_variants['width'] / image_variants['height'])}px"
+    sources = format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}"/>',
+        (
+            (mime_type, srcset, sizes)
+            for mime_type, srcset in srcsets.items()
+            if mime_type != image_variants["type"]
+        ),
+    )
+    return format_html(
+        '<picture>{sources}<img src="{src}" srcset="{srcset}" sizes="{sizes}" '
+        'style="max-height: {height}px;"/></picture>',
+        sources=sources,
+        src=image.url,
+        srcset=srcsets[image_variants["type"]],
+        sizes=sizes,
+        height=height,
+    )
 
 
 class RestaurantMenuItemInline(admin.TabularInline):
@@ -39,6 +75,11 @@ class RestaurantAdmin(admin.ModelAdmin):
     ]
     inlines = [RestaurantMenuItemInline]
 
+    def save_model(self, request, obj, form, change):
+        if "address" in form.changed_data:
+            obj.location = request_location(obj.address) if obj.address else None
+        super().save_model(request, obj, form, change)
+
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -97,9 +138,7 @@ class ProductAdmin(admin.ModelAdmin):
     def get_image_preview(self, obj):
         if not obj.image:
             return "выберите картинку"
-        return format_html(
-            '<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url
-        )
+        return render_image_preview(obj.image, obj.image_variants, height=200)
 
     get_image_preview.short_description = "превью"
 
@@ -108,9 +147,9 @@ class ProductAdmin(admin.ModelAdmin):
             return "нет картинки"
         edit_url = reverse("admin:foodcartapp_product_change", args=(obj.id,))
         return format_html(
-            '<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>',
+            '<a href="{edit_url}">{preview}</a>',
             edit_url=edit_url,
-            src=obj.image.url,
+            preview=render_image_preview(obj.image, obj.image_variants, height=50),
         )
 
     get_image_list_preview.short_description = "превью"
@@ -131,7 +170,16 @@ class OrderAdmin(admin.ModelAdmin):
         "first_name",
         "phone_number",
         "address",
+        "total_price",
     ]
+    readonly_fields = [
+        "total_price",
+    ]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).recalculate_total_prices()
+        update_order_candidates(Order.objects.filter(pk=form.instance.pk))
 
     def response_change(self, request, obj):
         res = super().response_change(request, obj)
@@ -142,3 +190,18 @@ class OrderAdmin(admin.ModelAdmin):
             return HttpResponseRedirect(next)
         else:
             return res
+
+
+@admin.register(RestaurantAssignment)
+class RestaurantAssignmentAdmin(admin.ModelAdmin):
+    list_display = [
+        "order",
+        "restaurant",
+        "distance",
+        "restaurant_load",
+        "assigned_at",
+    ]
+    list_select_related = [
+        "order",
+        "restaurant",
+    ]
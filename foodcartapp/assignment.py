@@ -0,0 +1,86 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from foodcartapp.models import Order, RestaurantAssignment
+
+
+def get_restaurant_loads():
+    return Counter(
+        dict(
+            Order.objects.filter(status=Order.COOKING, restaurant__isnull=False)
+            .order_by()
+            .values("restaurant")
+            .annotate(orders_count=Count("id"))
+            .values_list("restaurant", "orders_count")
+        )
+    )
+
+
+def choose_restaurant(order, restaurant_loads):
+    # The nearest restaurant able to cook the whole order, where every order
+    # the restaurant is already cooking counts as a detour of
+    # ASSIGNMENT_LOAD_PENALTY_KM.
+    candidates = [
+        (restaurant, restaurant_distance)
+        for restaurant, restaurant_distance in order.suitable_restaurants_with_distances
+        if restaurant_distance is not None
+    ]
+    if not candidates:
+        return None, None
+    return min(
+        candidates,
+        key=lambda candidate: candidate[1]
+        + settings.ASSIGNMENT_LOAD_PENALTY_KM * restaurant_loads[candidate[0].id],
+    )
+
+
+def assign_restaurants(orders=None):
+    # Assign restaurants to new unassigned orders (all of them by default)
+    # and record every decision. Returns the created assignments.
+    # An order is assigned once: if a manager takes the restaurant away,
+    # the order is left to the managers.
+    if orders is None:
+        orders = Order.objects.all()
+
+    with transaction.atomic():
+        orders = (
+            orders.filter(
+                status=Order.NEW,
+                restaurant__isnull=True,
+                assignment__isnull=True,
+                location__latitude__isnull=False,
+            )
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("registered_at", "id")
+            .with_candidates()
+        )
+        restaurant_loads = get_restaurant_loads()
+
+        assigned_orders = []
+        assignments = []
+        for order in orders:
+            restaurant, restaurant_distance = choose_restaurant(order, restaurant_loads)
+            if restaurant is None:
+                continue
+            assignments.append(
+                RestaurantAssignment(
+                    order=order,
+                    restaurant=restaurant,
+                    distance=restaurant_distance,
+                    restaurant_load=restaurant_loads[restaurant.id],
+                )
+            )
+            order.restaurant = restaurant
+            order.updated_at = timezone.now()
+            assigned_orders.append(order)
+            restaurant_loads[restaurant.id] += 1
+
+        Order.objects.bulk_update(
+            assigned_orders, ["restaurant", "updated_at"], batch_size=500
+        )
+        RestaurantAssignment.objects.bulk_create(assignments, batch_size=500)
+    return assignments
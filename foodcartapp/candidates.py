@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from foodcartapp.models import Order, OrderCandidate
+
+CANDIDATES_BATCH_SIZE = 500
+# As precise as the dashboard shows distances
+DISTANCE_PRECISION = 2
+
+
+def get_candidate_sets(candidates):
+    # {order id: {(restaurant id, rounded distance)}}
+    candidate_sets = defaultdict(set)
+    for order_id, restaurant_id, distance in candidates:
+        if distance is not None:
+            distance = round(distance, DISTANCE_PRECISION)
+        candidate_sets[order_id].add((restaurant_id, distance))
+    return candidate_sets
+
+
+def update_order_candidates(orders):
+    # Recompute the restaurants able to cook each of the orders
+    # and their distances. Returns the number of checked orders.
+    order_ids = list(orders.order_by("id").values_list("id", flat=True).distinct())
+    for batch_start in range(0, len(order_ids), CANDIDATES_BATCH_SIZE):
+        batch_ids = order_ids[batch_start : batch_start + CANDIDATES_BATCH_SIZE]
+        # Cleared before reading menus and locations: a change committed
+        # meanwhile marks the orders outdated again
+        Order.objects.filter(id__in=batch_ids).update(candidates_outdated=False)
+        try:
+            batch_orders = (
+                Order.objects.filter(id__in=batch_ids)
+                .with_restaurants(radius_km=settings.RESTAURANT_SEARCH_RADIUS_KM)
+                .with_distances()
+            )
+            candidates = [
+                OrderCandidate(
+                    order=order,
+                    restaurant=restaurant,
+                    distance=restaurant_distance,
+                )
+                for order in batch_orders
+                for restaurant, restaurant_distance in (
+                    order.suitable_restaurants_with_distances
+                )
+            ]
+            previous_sets = get_candidate_sets(
+                OrderCandidate.objects.filter(order_id__in=batch_ids).values_list(
+                    "order_id", "restaurant_id", "distance"
+                )
+            )
+            candidate_sets = get_candidate_sets(
+                (candidate.order_id, candidate.restaurant_id, candidate.distance)
+                for candidate in candidates
+            )
+            # Only orders whose candidates changed are rewritten and shown
+            # to managers as updated
+            changed_ids = {
+                order_id
+                for order_id in batch_ids
+                if previous_sets[order_id] != candidate_sets[order_id]
+            }
+            if not changed_ids:
+                continue
+            with transaction.atomic():
+                OrderCandidate.objects.filter(order_id__in=changed_ids).delete()
+                OrderCandidate.objects.bulk_create(
+                    [
+                        candidate
+                        for candidate in candidates
+                        if candidate.order_id in changed_ids
+                    ],
+                    batch_size=500,
+                )
+                Order.objects.filter(id__in=changed_ids).update(
+                    updated_at=timezone.now()
+                )
+        except Exception:
+            mark_candidates_outdated(Order.objects.filter(id__in=batch_ids))
+            raise
+    return len(order_ids)
+
+
+def mark_candidates_outdated(orders):
+    # Cheap enough for signal handlers: the candidates themselves are
+    # recomputed by `update_outdated_order_candidates` in the sweep
+    return orders.filter(candidates_outdated=False).update(candidates_outdated=True)
+
+
+def update_outdated_order_candidates():
+    return update_order_candidates(
+        Order.objects.unfinished().filter(candidates_outdated=True)
+    )
@@ -0,0 +1,74 @@
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+from foodcartapp.models import CacheVersion, Product
+from foodcartapp.payloads import JsonPayload
+from foodcartapp.thumbnails import get_image_srcsets
+
+CATALOG_VERSION = "catalog"
+CATALOG_TIMEOUT = 24 * 60 * 60
+
+catalog_cache = ConnectionProxy(caches, "catalog")
+
+# (catalog version, {product id: Product}, ids of available products)
+products_snapshot = (None, {}, set())
+
+
+def get_catalog_version():
+    return CacheVersion.objects.get_version(CATALOG_VERSION)
+
+
+def bump_catalog_version():
+    CacheVersion.objects.bump(CATALOG_VERSION)
+
+
+def serialize_product(product):
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "special_status": product.special_status,
+        "description": product.description,
+        "category": {
+            "id": product.category.id,
+            "name": product.category.name,
+        }
+        if product.category
+        else None,
+        "image": product.image.url,
+        "image_srcset": get_image_srcsets(product.image, product.image_variants),
+        "restaurant": {
+            "id": product.id,
+            "name": product.name,
+        },
+    }
+
+
+def get_catalog_payload():
+    version = get_catalog_version()
+    cache_key = f"catalog:products:{version}"
+
+    payload = catalog_cache.get(cache_key)
+    if payload is None:
+        products = Product.objects.select_related("category").available()
+        payload = JsonPayload(
+            [serialize_product(product) for product in products],
+            last_modified=version / 10**9,
+        )
+        catalog_cache.set(cache_key, payload, timeout=CATALOG_TIMEOUT)
+    return payload
+
+
+def get_products_snapshot():
+    # In-process copy of the catalog used to validate orders
+    # without querying every product, renewed when the catalog version changes.
+    global products_snapshot
+
+    version = get_catalog_version()
+    if products_snapshot[0] != version:
+        products = Product.objects.in_bulk()
+        available_product_ids = set(
+            Product.objects.available().values_list("id", flat=True)
+        )
+        products_snapshot = (version, products, available_product_ids)
+    return products_snapshot[1:]
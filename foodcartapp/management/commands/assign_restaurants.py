@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.assignment import assign_restaurants
+from foodcartapp.candidates import update_outdated_order_candidates
+
+
+class Command(BaseCommand):
+    help = "Назначает рестораны новым заказам, которым они ещё не назначены"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="повторять обход с этой паузой, в секундах, вместо однократного",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            update_outdated_order_candidates()
+            assignments = assign_restaurants()
+            self.stdout.write(f"Назначено заказов: {len(assignments)}")
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
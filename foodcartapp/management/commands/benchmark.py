@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from foodcartapp.candidates import update_order_candidates
+from foodcartapp.models import (
+    Order,
+    OrderProduct,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from locations.geocoding import parse_coordinates
+from locations.models import Location
+from star_burger.cache_url import get_caches
+
+BATCH_SIZE = 5000
+MOSCOW = (55.75, 37.62)
+
+
+def fetch_stub_coordinates(address):
+    # Deterministic coordinates within ~20 km of the center, no network
+    digest = hashlib.sha1(address.encode()).digest()
+    return (
+        str(MOSCOW[0] + (digest[0] - 128) / 700),
+        str(MOSCOW[1] + (digest[1] - 128) / 400),
+    )
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"должно быть не меньше 1: {value}")
+    return number
+
+
+def get_percentile(timings, percentile):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * percentile))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет скорость и число запросов к БД основных страниц и API "
+        "на сгенерированных данных во временной базе данных"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=10000)
+        parser.add_argument("--restaurants", type=positive_int, default=50)
+        parser.add_argument("--products", type=positive_int, default=200)
+        parser.add_argument("--addresses", type=positive_int, default=2000)
+        parser.add_argument(
+            "--requests",
+            type=positive_int,
+            default=20,
+            help="сколько раз запрашивать каждую страницу",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="benchmark.json")
+        parser.add_argument(
+            "--compare",
+            help="JSON с результатами прошлого запуска для сравнения",
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        old_database_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                DEBUG=False,
+                ALLOWED_HOSTS=["*"],
+                CACHES=get_caches("locmem://benchmark"),
+            ), mock.patch(
+                "locations.geocoding.fetch_coordinates", fetch_stub_coordinates
+            ):
+                started_at = time.perf_counter()
+                self.generate_data(options)
+                generation_time = time.perf_counter() - started_at
+                results = self.run_benchmarks(options["requests"])
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "scale": {
+                name: options[name]
+                for name in ("orders", "restaurants", "products", "addresses")
+            },
+            "generation_seconds": round(generation_time, 3),
+            "results": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+
+        self.print_results(results)
+        if options["compare"]:
+            with open(options["compare"]) as previous_output:
+                self.print_comparison(json.load(previous_output)["results"], results)
+
+    def generate_data(self, options):
+        categories = ProductCategory.objects.bulk_create(
+            [ProductCategory(name=f"Категория {number}") for number in range(10)]
+        )
+        products = Product.objects.bulk_create(
+            [
+                Product(
+                    name=f"Товар {number}",
+                    category=random.choice(categories),
+                    price=Decimal(random.randrange(100, 1000)),
+                    image="benchmark.png",
+                )
+                for number in range(options["products"])
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        locations = []
+        for number in range(options["addresses"] + options["restaurants"]):
+            address = f"Москва, улица Тестовая, {number}"
+            latitude, longitude = parse_coordinates(fetch_stub_coordinates(address))
+            locations.append(
+                Location(address=address, latitude=latitude, longitude=longitude)
+            )
+        locations = Location.objects.bulk_create(locations, batch_size=BATCH_SIZE)
+        restaurant_locations = locations[: options["restaurants"]]
+        self.order_locations = locations[options["restaurants"] :]
+
+        restaurants = Restaurant.objects.bulk_create(
+            [
+                Restaurant(
+                    name=f"Ресторан {number}",
+                    address=location.address,
+                    location=location,
+                )
+                for number, location in enumerate(restaurant_locations)
+            ]
+        )
+        RestaurantMenuItem.objects.bulk_create(
+            [
+                RestaurantMenuItem(
+                    restaurant=restaurant,
+                    product=product,
+                    availability=random.random() < 0.9,
+                )
+                for restaurant in restaurants
+                for product in products
+                if random.random() < 0.7
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        self.products = products
+        for batch_start in range(0, options["orders"], BATCH_SIZE):
+            batch_size = min(BATCH_SIZE, options["orders"] - batch_start)
+            self.generate_orders(batch_size, restaurants)
+        update_order_candidates(Order.objects.unfinished())
+
+        User.objects.create_user("benchmark", is_staff=True)
+
+    def generate_orders(self, orders_count, restaurants):
+        orders = []
+        order_products = []
+        for _ in range(orders_count):
+            location = random.choice(self.order_locations)
+            status = random.choices(
+                [status for status, _ in Order.STATUS_CHOICES],
+                weights=[5, 5, 5, 5, 80],
+            )[0]
+            order = Order(
+                first_name="Иван",
+                last_name="Иванов",
+                phone_number="+79161234567",
+                address=location.address,
+                location=location,
+                status=status,
+                restaurant=random.choice(restaurants) if status else None,
+                registered_at=timezone.now()
+                - timedelta(minutes=random.randrange(60 * 24 * 365)),
+            )
+            for product in random.sample(self.products, random.randint(1, 5)):
+                amount = random.randint(1, 3)
+                order_products.append(
+                    OrderProduct(
+                        order=order,
+                        product=product,
+                        amount=amount,
+                        static_price=product.price * amount,
+                    )
+                )
+                order.total_price += product.price * amount
+            orders.append(order)
+
+        Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+        OrderProduct.objects.bulk_create(order_products, batch_size=BATCH_SIZE)
+
+    def get_order_payload(self):
+        return {
+            "firstname": "Иван",
+            "lastname": "Иванов",
+            "phonenumber": "+79161234567",
+            "address": random.choice(self.order_locations).address,
+            "products": [
+                {"product": product.id, "quantity": random.randint(1, 3)}
+                for product in random.sample(self.products, random.randint(1, 5))
+            ],
+        }
+
+    def run_benchmarks(self, requests_count):
+        client = Client()
+        manager_client = Client()
+        manager_client.force_login(User.objects.get(username="benchmark"))
+
+        benchmarks = {
+            "product_list_api": lambda: client.get("/api/products/"),
+            "register_order": lambda: client.post(
+                "/api/order/",
+                self.get_order_payload(),
+                content_type="application/json",
+            ),
+            "view_orders": lambda: manager_client.get("/manager/orders/"),
+            "view_products": lambda: manager_client.get("/manager/products/"),
+        }
+        return {
+            name: self.measure(make_request, requests_count)
+            for name, make_request in benchmarks.items()
+        }
+
+    def measure(self, make_request, requests_count):
+        # The first request warms the caches up and is measured separately
+        timings = []
+        queries_counts = []
+        for _ in range(requests_count + 1):
+            with CaptureQueriesContext(connection) as queries:
+                started_at = time.perf_counter()
+                response = make_request()
+                timings.append(time.perf_counter() - started_at)
+            queries_counts.append(len(queries))
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    f"{response.request['PATH_INFO']} responded "
+                    f"with {response.status_code}: {response.content[:500]}"
+                )
+
+        first_timing, timings = timings[0], timings[1:]
+        first_queries_count, queries_counts = queries_counts[0], queries_counts[1:]
+        return {
+            "requests": requests_count,
+            "first_request_ms": round(first_timing * 1000, 2),
+            "first_request_queries": first_queries_count,
+            "mean_ms": round(statistics.mean(timings) * 1000, 2),
+            "median_ms": round(statistics.median(timings) * 1000, 2),
+            "p95_ms": round(get_percentile(timings, 0.95) * 1000, 2),
+            "requests_per_second": round(len(timings) / sum(timings), 1),
+            "queries": max(queries_counts),
+        }
+
+    def print_results(self, results):
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: медиана {result['median_ms']} мс, "
+                f"p95 {result['p95_ms']} мс, "
+                f"{result['requests_per_second']} запросов/с, "
+                f"запросов к БД {result['queries']}"
+            )
+
+    def print_comparison(self, previous_results, results):
+        self.stdout.write("Сравнение с прошлым запуском:")
+        for name, result in results.items():
+            previous_result = previous_results.get(name)
+            if not previous_result:
+                continue
+            change = result["median_ms"] / previous_result["median_ms"] - 1
+            self.stdout.write(
+                f"{name}: медиана {previous_result['median_ms']} → "
+                f"{result['median_ms']} мс ({change:+.0%}), "
+                f"запросов к БД {previous_result['queries']} → {result['queries']}"
+            )
@@ -0,0 +1,338 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from foodcartapp.management.commands.benchmark import (
+    fetch_stub_coordinates,
+    get_percentile,
+    positive_int,
+)
+from foodcartapp.models import (
+    Order,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from locations.geocoding import parse_coordinates
+from locations.models import Location
+
+SERVER_START_TIMEOUT = 30
+
+
+class GeocoderStubHandler(BaseHTTPRequestHandler):
+    # Answers like the Yandex geocoder after `server.latency` seconds
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        address = parse_qs(urlparse(self.path).query)["geocode"][0]
+        latitude, longitude = fetch_stub_coordinates(address)
+        body = json.dumps(
+            {
+                "response": {
+                    "GeoObjectCollection": {
+                        "featureMember": [
+                            {"GeoObject": {"Point": {"pos": f"{longitude} {latitude}"}}}
+                        ]
+                    }
+                }
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_database_url(settings_dict):
+    if connection.vendor == "sqlite":
+        return f"sqlite:///{settings_dict['NAME']}"
+    credentials = quote(settings_dict["USER"] or "")
+    if settings_dict["PASSWORD"]:
+        credentials += ":" + quote(settings_dict["PASSWORD"])
+    return (
+        f"postgres://{credentials}@{settings_dict['HOST'] or 'localhost'}:"
+        f"{settings_dict['PORT'] or 5432}/{settings_dict['NAME']}"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает оформление заказов под gunicorn (WSGI) и uvicorn (ASGI) "
+        "во временной базе данных с локальной заглушкой геокодера"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=positive_int, default=1000)
+        parser.add_argument(
+            "--concurrency",
+            type=positive_int,
+            default=100,
+            help="сколько заказов оформлять одновременно",
+        )
+        parser.add_argument("--workers", type=positive_int, default=1)
+        parser.add_argument(
+            "--threads",
+            type=positive_int,
+            default=8,
+            help="потоков в каждом процессе gunicorn",
+        )
+        parser.add_argument(
+            "--geocoder-latency",
+            type=float,
+            default=0.2,
+            help="через сколько секунд отвечает заглушка геокодера",
+        )
+        parser.add_argument("--output", default="benchmark_intake.json")
+
+    def handle(self, *args, **options):
+        if connection.vendor == "sqlite":
+            self.stderr.write(
+                "SQLite не справляется с одновременной записью из нескольких "
+                "потоков и процессов, замеряйте на PostgreSQL"
+            )
+            # Servers are separate processes and cannot see an in-memory DB
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                tempfile.gettempdir(), "star_burger_benchmark.sqlite3"
+            )
+        old_database_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        geocoder_stub = ThreadingHTTPServer(("127.0.0.1", 0), GeocoderStubHandler)
+        geocoder_stub.latency = options["geocoder_latency"]
+        threading.Thread(target=geocoder_stub.serve_forever, daemon=True).start()
+        try:
+            self.generate_data()
+            env = {
+                **os.environ,
+                "DEBUG": "False",
+                "ALLOWED_HOSTS": "127.0.0.1",
+                "DATABASE_URL": get_database_url(connection.settings_dict),
+                "CACHE_URL": "locmem://",
+                "GEOCODER_URL": f"http://127.0.0.1:{geocoder_stub.server_port}/",
+                "ROLLBAR_TOKEN": "",
+            }
+            servers = {
+                "wsgi": (
+                    [
+                        "gunicorn",
+                        "star_burger.wsgi:application",
+                        "--worker-class",
+                        "gthread",
+                        "--workers",
+                        str(options["workers"]),
+                        "--threads",
+                        str(options["threads"]),
+                    ],
+                    {**env, "ASYNC_ORDER_INTAKE": "False"},
+                ),
+                "asgi": (
+                    [
+                        "uvicorn",
+                        "star_burger.asgi:application",
+                        "--workers",
+                        str(options["workers"]),
+                    ],
+                    {**env, "ASYNC_ORDER_INTAKE": "True"},
+                ),
+            }
+            results = {
+                name: self.run_benchmark(name, command, server_env, options)
+                for name, (command, server_env) in servers.items()
+            }
+        finally:
+            geocoder_stub.shutdown()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "options": {
+                name: options[name]
+                for name in (
+                    "requests",
+                    "concurrency",
+                    "workers",
+                    "threads",
+                    "geocoder_latency",
+                )
+            },
+            "results": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.print_results(results)
+
+    def generate_data(self):
+        category = ProductCategory.objects.create(name="Категория")
+        self.products = Product.objects.bulk_create(
+            [
+                Product(
+                    name=f"Товар {number}",
+                    category=category,
+                    price=Decimal(100 + number),
+                    image="benchmark.png",
+                )
+                for number in range(20)
+            ]
+        )
+        restaurants = []
+        for number in range(10):
+            address = f"Москва, улица Ресторанная, {number}"
+            latitude, longitude = parse_coordinates(fetch_stub_coordinates(address))
+            location = Location.objects.create(
+                address=address,
+                latitude=latitude,
+                longitude=longitude,
+                requested_at=timezone.now(),
+            )
+            restaurants.append(
+                Restaurant(
+                    name=f"Ресторан {number}", address=address, location=location
+                )
+            )
+        Restaurant.objects.bulk_create(restaurants)
+        RestaurantMenuItem.objects.bulk_create(
+            [
+                RestaurantMenuItem(restaurant=restaurant, product=product)
+                for restaurant in restaurants
+                for product in self.products
+            ]
+        )
+
+    def run_benchmark(self, name, command, env, options):
+        port = get_free_port()
+        if command[0] == "gunicorn":
+            command += ["--bind", f"127.0.0.1:{port}"]
+        else:
+            command += ["--host", "127.0.0.1", "--port", str(port)]
+        server = subprocess.Popen(
+            [sys.executable, "-m", *command],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            self.wait_for_server(server, port)
+            result = asyncio.run(
+                self.send_orders(
+                    f"http://127.0.0.1:{port}/api/order/",
+                    address_prefix=f"Москва, улица {name}, ",
+                    requests_count=options["requests"],
+                    concurrency=options["concurrency"],
+                )
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+        orders = Order.objects.filter(address__startswith=f"Москва, улица {name}, ")
+        result["orders"] = orders.count()
+        result["geocoded_orders"] = orders.filter(
+            location__latitude__isnull=False
+        ).count()
+        return result
+
+    def wait_for_server(self, server, port):
+        started_at = time.monotonic()
+        while time.monotonic() - started_at < SERVER_START_TIMEOUT:
+            if server.poll() is not None:
+                raise CommandError(
+                    f"Сервер не запустился:\n{server.stderr.read().decode()}"
+                )
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/api/products/").raise_for_status()
+            except httpx.HTTPError:
+                time.sleep(0.2)
+            else:
+                return
+        raise CommandError(f"Сервер не ответил за {SERVER_START_TIMEOUT} с")
+
+    def get_order_payload(self, address):
+        return {
+            "firstname": "Иван",
+            "lastname": "Иванов",
+            "phonenumber": "+79161234567",
+            "address": address,
+            "products": [
+                {"product": product.id, "quantity": 1} for product in self.products[:3]
+            ],
+        }
+
+    async def send_orders(self, url, address_prefix, requests_count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+        errors = 0
+
+        async def send_order(client, number):
+            nonlocal errors
+            async with semaphore:
+                started_at = time.perf_counter()
+                try:
+                    response = await client.post(
+                        url, json=self.get_order_payload(f"{address_prefix}{number}")
+                    )
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                else:
+                    timings.append(time.perf_counter() - started_at)
+
+        async with httpx.AsyncClient(
+            timeout=60, limits=httpx.Limits(max_connections=concurrency)
+        ) as client:
+            started_at = time.perf_counter()
+            await asyncio.gather(
+                *(send_order(client, number) for number in range(requests_count))
+            )
+            total_time = time.perf_counter() - started_at
+
+        if not timings:
+            raise CommandError(f"Все запросы к {url} завершились ошибкой")
+        return {
+            "requests": requests_count,
+            "errors": errors,
+            "mean_ms": round(statistics.mean(timings) * 1000, 2),
+            "median_ms": round(statistics.median(timings) * 1000, 2),
+            "p95_ms": round(get_percentile(timings, 0.95) * 1000, 2),
+            "requests_per_second": round(len(timings) / total_time, 1),
+        }
+
+    def print_results(self, results):
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: медиана {result['median_ms']} мс, "
+                f"p95 {result['p95_ms']} мс, "
+                f"{result['requests_per_second']} заказов/с, "
+                f"ошибок {result['errors']}, "
+                f"с координатами сразу {result['geocoded_orders']} "
+                f"из {result['orders']} заказов"
+            )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.catalog import bump_catalog_version
+from foodcartapp.models import Product
+from foodcartapp.thumbnails import has_image_variants, update_image_variants
+
+
+class Command(BaseCommand):
+    help = "Создаёт уменьшенные копии картинок товаров, в том числе в формате WebP"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="пересоздать копии и у товаров, для которых они уже есть",
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image="").only("image", "image_variants")
+        updated_count = 0
+        for product in products.iterator():
+            if not options["force"] and has_image_variants(
+                product.image, product.image_variants
+            ):
+                continue
+            try:
+                update_image_variants(product)
+            except OSError as error:
+                self.stderr.write(f"Товар {product.id}: {error}")
+                continue
+            updated_count += 1
+
+        if updated_count:
+            bump_catalog_version()
+        self.stdout.write(f"Обработано товаров: {updated_count}")
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from foodcartapp.candidates import update_order_candidates
+from foodcartapp.models import Order, Restaurant
+from locations.geocoding import (
+    RateLimiter,
+    fetch_coordinates,
+    is_fresh,
+    normalize_address,
+    save_geocoded_locations,
+)
+from locations.models import Location
+from locations.spatial import bump_grid_version
+
+
+def get_not_geocoded_filter(prefix=""):
+    # No coordinates, and the geocoder was not asked or its "not found"
+    # answer is outdated, see `is_fresh`
+    expired_at = timezone.now() - settings.GEOCODER_NEGATIVE_CACHE_TTL
+    return Q(**{f"{prefix}latitude__isnull": True}) & (
+        Q(**{f"{prefix}requested_at__isnull": True})
+        | Q(**{f"{prefix}requested_at__lt": expired_at})
+    )
+
+
+class Command(BaseCommand):
+    help = "Определяет координаты всех адресов ресторанов и заказов, у которых их нет"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="сколько запросов к геокодеру выполнять одновременно",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=10,
+            help="не больше стольких запросов к геокодеру в секунду",
+        )
+
+    def handle(self, *args, **options):
+        not_located = Q(location__isnull=True) | get_not_geocoded_filter("location__")
+        restaurants = list(Restaurant.objects.exclude(address="").filter(not_located))
+        orders = list(
+            Order.objects.filter(not_located).only("id", "address", "location")
+        )
+        addresses = {
+            normalize_address(entry.address) for entry in [*restaurants, *orders]
+        }
+        addresses |= set(
+            Location.objects.filter(get_not_geocoded_filter()).values_list(
+                "address", flat=True
+            )
+        )
+
+        # Entries without a location may have an address that is already known
+        fresh_locations = {
+            address: location
+            for address, location in Location.objects.in_bulk(
+                addresses, field_name="address"
+            ).items()
+            if is_fresh(location)
+        }
+        addresses -= fresh_locations.keys()
+        self.stdout.write(f"Адресов без координат: {len(addresses)}")
+
+        coordinates_by_address = self.fetch_all_coordinates(
+            addresses, workers=options["workers"], rate=options["rate"]
+        )
+        locations = {
+            **fresh_locations,
+            **save_geocoded_locations(coordinates_by_address),
+        }
+
+        linked_restaurants = self.link_locations(restaurants, locations)
+        Restaurant.objects.bulk_update(linked_restaurants, ["location"], batch_size=500)
+        linked_orders = self.link_locations(orders, locations)
+        Order.objects.bulk_update(linked_orders, ["location"], batch_size=500)
+        bump_grid_version()
+
+        if linked_restaurants:
+            updated_orders = Order.objects.unfinished()
+        else:
+            updated_orders = Order.objects.unfinished().filter(
+                location__in=locations.values()
+            )
+        update_order_candidates(updated_orders)
+
+        self.stdout.write(
+            f"Геокодировано адресов: {len(coordinates_by_address)}, "
+            f"ошибок: {len(addresses) - len(coordinates_by_address)}, "
+            f"привязано ресторанов: {len(linked_restaurants)}, "
+            f"заказов: {len(linked_orders)}"
+        )
+
+    def fetch_all_coordinates(self, addresses, workers, rate):
+        rate_limiter = RateLimiter(rate)
+
+        def fetch(address):
+            rate_limiter.wait()
+            return fetch_coordinates(address)
+
+        coordinates_by_address = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(fetch, address): address for address in addresses
+            }
+            for future in as_completed(futures):
+                address = futures[future]
+                try:
+                    coordinates_by_address[address] = future.result()
+                except Exception as error:
+                    # Keep the coordinates fetched for the other addresses
+                    self.stderr.write(f"{address}: {type(error).__name__}: {error}")
+        return coordinates_by_address
+
+    def link_locations(self, entries, locations):
+        linked_entries = []
+        for entry in entries:
+            location = locations.get(normalize_address(entry.address))
+            if location and entry.location_id != location.id:
+                entry.location = location
+                linked_entries.append(entry)
+        return linked_entries
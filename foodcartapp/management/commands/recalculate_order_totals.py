@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сохранённую стоимость заказов по их позициям"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="только проверить, что сохранённая стоимость совпадает с позициями",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            self.verify()
+        else:
+            self.recalculate(options["batch_size"])
+
+    def recalculate(self, batch_size):
+        order_ids = Order.objects.order_by("id").values_list("id", flat=True)
+        last_id = 0
+        updated_count = 0
+        while True:
+            batch_ids = list(order_ids.filter(id__gt=last_id)[:batch_size])
+            if not batch_ids:
+                break
+            updated_count += Order.objects.filter(
+                id__in=batch_ids
+            ).recalculate_total_prices()
+            last_id = batch_ids[-1]
+        self.stdout.write(f"Пересчитано заказов: {updated_count}")
+
+    def verify(self):
+        mismatched_orders = (
+            Order.objects.with_calculated_total_prices()
+            .exclude(total_price=F("calculated_total_price"))
+            .values_list("id", "total_price", "calculated_total_price")
+        )
+        mismatches_count = 0
+        for order_id, total_price, calculated_total_price in mismatched_orders:
+            mismatches_count += 1
+            self.stdout.write(
+                f"Заказ {order_id}: сохранено {total_price}, "
+                f"по позициям {calculated_total_price}"
+            )
+        if mismatches_count:
+            raise CommandError(f"Расходится стоимость заказов: {mismatches_count}")
+        self.stdout.write("Стоимость всех заказов совпадает с позициями")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.candidates import update_order_candidates
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Заново подбирает рестораны, способные приготовить незавершённые заказы, "
+        "и расстояния до них"
+    )
+
+    def handle(self, *args, **options):
+        updated_count = update_order_candidates(Order.objects.unfinished())
+        self.stdout.write(f"Обновлено заказов: {updated_count}")
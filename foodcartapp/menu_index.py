@@ -0,0 +1,40 @@
+def iter_bits(mask):
+    while mask:
+        lowest_bit = mask & -mask
+        yield lowest_bit.bit_length() - 1
+        mask ^= lowest_bit
+
+
+def to_mask(ids):
+    mask = 0
+    for id_ in ids:
+        mask |= 1 << id_
+    return mask
+
+
+class MenuIndex:
+    # Inverted index {product_id: bitset of restaurant ids}: bit N is set
+    # when the restaurant with id N has the product available.
+
+    def __init__(self, restaurants_by_product=None):
+        self.restaurants_by_product = restaurants_by_product or {}
+        self.all_restaurants = 0
+        for mask in self.restaurants_by_product.values():
+            self.all_restaurants |= mask
+
+    @property
+    def restaurant_ids(self):
+        return list(iter_bits(self.all_restaurants))
+
+    def get_restaurants_mask(self, product_ids, restaurants_mask=None):
+        mask = self.all_restaurants
+        if restaurants_mask is not None:
+            mask &= restaurants_mask
+        for product_id in product_ids:
+            mask &= self.restaurants_by_product.get(product_id, 0)
+            if not mask:
+                break
+        return mask
+
+    def find_restaurant_ids(self, product_ids, restaurants_mask=None):
+        return list(iter_bits(self.get_restaurants_mask(product_ids, restaurants_mask)))
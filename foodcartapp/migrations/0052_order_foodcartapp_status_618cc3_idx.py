@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-17 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0051_order_location_restaurant_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'registered_at', 'id'], name='foodcartapp_status_618cc3_idx'),
+        ),
+    ]
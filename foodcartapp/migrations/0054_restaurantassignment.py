@@ -0,0 +1,30 @@
+# Generated by Django 4.0.4 on 2026-10-17 20:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0053_restaurantmenuitem_foodcartapp_product_71ea38_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantAssignment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField(verbose_name='расстояние, км')),
+                ('restaurant_load', models.PositiveIntegerField(verbose_name='заказов в работе у ресторана')),
+                ('assigned_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='назначен')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='assignment', to='foodcartapp.order', verbose_name='заказ')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='foodcartapp.restaurant', verbose_name='ресторан')),
+            ],
+            options={
+                'verbose_name': 'автоматическое назначение ресторана',
+                'verbose_name_plural': 'автоматические назначения ресторанов',
+            },
+        ),
+    ]
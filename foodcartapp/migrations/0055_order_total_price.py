@@ -0,0 +1,43 @@
+# Generated by Django 4.0.4 on 2026-10-17 20:36
+
+from decimal import Decimal
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_total_price(apps, schema_editor):
+    Order = apps.get_model("foodcartapp", "Order")
+    OrderProduct = apps.get_model("foodcartapp", "OrderProduct")
+    order_totals = (
+        OrderProduct.objects.filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+        .annotate(total=Sum("static_price"))
+        .values("total")
+    )
+    Order.objects.update(
+        total_price=Coalesce(
+            Subquery(order_totals),
+            Value(Decimal(0)),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0054_restaurantassignment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='стоимость заказа'),
+        ),
+        migrations.RunPython(fill_total_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-17 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0059_cacheversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='candidates_outdated',
+            field=models.BooleanField(db_index=True, default=True, verbose_name='рестораны нужно подобрать заново'),
+        ),
+    ]
@@ -1,15 +1,80 @@
+import time
+from decimal import Decimal
+
+from django.core.cache import caches
 from django.core.validators import (
     MaxValueValidator,
     MinLengthValidator,
     MinValueValidator,
 )
 from django.db import models
-from django.db.models import Sum
+from django.db.models import (
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from geopy import distance
+from django.utils.connection import ConnectionProxy
 from phonenumber_field.modelfields import PhoneNumberField
 
+from foodcartapp.menu_index import MenuIndex, to_mask
+from locations.distances import get_exact_distance, get_location_distances
 from locations.models import Location
+from locations.spatial import restaurant_grid
+
+AVAILABILITY_KEY = "menu:availability:{version}:{product_id}"
+AVAILABILITY_VERSION = "availability"
+# Rows are rewritten on menu changes, the timeout is only a safety net
+AVAILABILITY_TIMEOUT = 60 * 60
+SHARED_VERSION_TTL = 5
+
+dashboard_cache = ConnectionProxy(caches, "dashboard")
+
+# {name: (version, when it was read)} of this process
+read_versions = {}
+
+
+class CacheVersionQuerySet(models.QuerySet):
+    def get_version(self, name, max_age=SHARED_VERSION_TTL):
+        # Each process re-reads a version at most every `max_age` seconds,
+        # so a change made in one worker reaches the others shortly
+        version, read_at = read_versions.get(name, (None, None))
+        if read_at is None or time.monotonic() - read_at >= max_age:
+            cache_version, _ = self.get_or_create(
+                name=name, defaults={"version": time.time_ns()}
+            )
+            version = cache_version.version
+            read_versions[name] = (version, time.monotonic())
+        return version
+
+    def bump(self, name):
+        version = time.time_ns()
+        self.update_or_create(name=name, defaults={"version": version})
+        read_versions[name] = (version, time.monotonic())
+        return version
+
+
+class CacheVersion(models.Model):
+    # Versions of cached data kept in the DB: unlike a per-process cache,
+    # all workers see the same version
+    name = models.CharField("название", max_length=50, unique=True)
+    version = models.BigIntegerField("версия")
+
+    objects = CacheVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "версия кэша"
+        verbose_name_plural = "версии кэша"
+
+    def __str__(self):
+        return self.name
 
 
 class Restaurant(models.Model):
@@ -42,11 +107,21 @@ class Restaurant(models.Model):
 
 
 class ProductQuerySet(models.QuerySet):
-    def available(self):
-        products = RestaurantMenuItem.objects.filter(availability=True).values_list(
-            "product"
+    def available(self, with_restaurants_count=False):
+        available_menu_items = RestaurantMenuItem.objects.filter(
+            product=OuterRef("pk"),
+            availability=True,
         )
-        return self.filter(pk__in=products)
+        products = self.filter(Exists(available_menu_items))
+        if with_restaurants_count:
+            restaurants_count = (
+                available_menu_items.order_by()
+                .values("product")
+                .annotate(count=Count("pk"))
+                .values("count")
+            )
+            products = products.annotate(restaurants_count=Subquery(restaurants_count))
+        return products
 
 
 class ProductCategory(models.Model):
@@ -74,6 +149,12 @@ class Product(models.Model):
         "цена", max_digits=8, decimal_places=2, validators=[MinValueValidator(0)]
     )
     image = models.ImageField("картинка")
+    image_variants = models.JSONField(
+        "уменьшенные копии картинки",
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     special_status = models.BooleanField(
         "спец.предложение",
         default=False,
@@ -95,6 +176,56 @@ class Product(models.Model):
         return self.name
 
 
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    def build_availability_rows(self, product_ids):
+        rows = {product_id: 0 for product_id in product_ids}
+        menu_items = self.filter(
+            product_id__in=product_ids,
+            availability=True,
+        ).values_list("product_id", "restaurant_id")
+        for product_id, restaurant_id in menu_items:
+            rows[product_id] |= 1 << restaurant_id
+        return rows
+
+    def get_availability_keys(self, product_ids):
+        # {cache key: product_id}
+        version = CacheVersion.objects.get_version(AVAILABILITY_VERSION)
+        return {
+            AVAILABILITY_KEY.format(version=version, product_id=product_id): (
+                product_id
+            )
+            for product_id in product_ids
+        }
+
+    def get_availability_rows(self, product_ids):
+        # {product_id: bitset of ids of restaurants selling the product},
+        # read from the cache and built from the DB only for missing rows
+        keys = self.get_availability_keys(product_ids)
+        rows = {keys[key]: row for key, row in dashboard_cache.get_many(keys).items()}
+
+        missing_product_ids = set(keys.values()) - rows.keys()
+        if missing_product_ids:
+            missing_rows = self.build_availability_rows(missing_product_ids)
+            for key, product_id in keys.items():
+                if product_id in missing_rows:
+                    # Not over a row written meanwhile by `update_availability_rows`
+                    dashboard_cache.add(
+                        key, missing_rows[product_id], timeout=AVAILABILITY_TIMEOUT
+                    )
+            rows.update(missing_rows)
+        return rows
+
+    def update_availability_rows(self, product_ids):
+        # Rewrite the rows of the products whose menus changed,
+        # the rows of other products are kept
+        keys = self.get_availability_keys(product_ids)
+        rows = self.build_availability_rows(product_ids)
+        dashboard_cache.set_many(
+            {key: rows[product_id] for key, product_id in keys.items()},
+            timeout=AVAILABILITY_TIMEOUT,
+        )
+
+
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
         Restaurant,
@@ -110,73 +241,160 @@ class RestaurantMenuItem(models.Model):
     )
     availability = models.BooleanField("в продаже", default=True, db_index=True)
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = "пункт меню ресторана"
         verbose_name_plural = "пункты меню ресторана"
         unique_together = [["restaurant", "product"]]
+        indexes = [
+            models.Index(fields=["product", "availability"]),
+        ]
 
     def __str__(self):
         return f"{self.restaurant.name} - {self.product.name}"
 
 
 class OrderQuerySet(models.QuerySet):
-    def with_total_prices(self):
-        return self.annotate(total_price=Sum("order_products__static_price"))
-
-    def with_restaurants(self):
-        orders = self.select_related("restaurant", "location").prefetch_related(
-            "order_products__product"
+    def unfinished(self):
+        return self.exclude(status=Order.FINISHED)
+
+    def after(self, status, registered_at, order_id):
+        # Keyset pagination: orders following the given one
+        # in the (status, registered_at, id) ordering.
+        return self.filter(
+            Q(status__gt=status)
+            | Q(status=status, registered_at__gt=registered_at)
+            | Q(status=status, registered_at=registered_at, id__gt=order_id)
+        ).order_by("status", "registered_at", "id")
+
+    def with_calculated_total_prices(self):
+        order_totals = (
+            OrderProduct.objects.filter(order=OuterRef("pk"))
+            .order_by()
+            .values("order")
+            .annotate(total=Sum("static_price"))
+            .values("total")
         )
-        restaurant_menu_items = (
-            RestaurantMenuItem.objects.prefetch_related("restaurant__location")
-            .select_related("product")
-            .filter(availability=True)
+        return self.annotate(
+            calculated_total_price=Coalesce(
+                Subquery(order_totals),
+                Value(Decimal(0)),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            )
+        )
+
+    def recalculate_total_prices(self):
+        return (
+            self.with_calculated_total_prices()
+            .exclude(total_price=F("calculated_total_price"))
+            .update(total_price=F("calculated_total_price"), updated_at=timezone.now())
         )
 
-        # Build {Restaurant: set(Products)} dict
-        restaurants_and_products = {
-            entry.restaurant: set() for entry in restaurant_menu_items
+    def with_restaurants(self, radius_km=None):
+        # With `radius_km` only restaurants within that distance from
+        # the order are considered, found with the restaurants spatial grid.
+        orders = self.select_related("restaurant", "location").prefetch_related(
+            "order_products"
+        )
+        product_ids = {
+            order_product.product_id
+            for order in orders
+            for order_product in order.order_products.all()
         }
-        for entry in restaurant_menu_items:
-            restaurants_and_products[entry.restaurant].add(entry.product)
+        menu_index = MenuIndex(
+            RestaurantMenuItem.objects.get_availability_rows(product_ids)
+        )
+        restaurants = Restaurant.objects.select_related("location").in_bulk(
+            menu_index.restaurant_ids
+        )
+        if radius_km is not None:
+            # Nor is the grid
+            restaurant_grid.refresh(max_age=0)
 
         for order in orders:
-            order_products = set(entry.product for entry in order.order_products.all())
-
-            order.suitable_restaurants = []
-            for restaurant, products in restaurants_and_products.items():
-                if order_products.issubset(products):
-                    order.suitable_restaurants.append(restaurant)
+            nearby_restaurants = None
+            if radius_km is not None and order.location and order.location.coordinates:
+                nearby_restaurants = to_mask(
+                    restaurant_id
+                    for restaurant_id, _ in restaurant_grid.find_nearest(
+                        order.location.coordinates, radius_km
+                    )
+                )
+            order_products = {entry.product_id for entry in order.order_products.all()}
+            order.suitable_restaurants = [
+                restaurants[restaurant_id]
+                for restaurant_id in menu_index.find_restaurant_ids(
+                    order_products, nearby_restaurants
+                )
+            ]
 
         return orders
 
-    def with_distances(self):
+    def with_distances(self, exact=False):
         # Use only after `with_restaurants()` QuerySet method:
         # orders must have `suitable_restaurants`.
+        # Distances are cached by location pair. With `exact=True`
+        # the nearest restaurant distance is refined with a geodesic
+        # instead of the haversine approximation.
+        location_pairs = [
+            (order.location, restaurant.location)
+            for order in self
+            if order.location and order.location.coordinates
+            for restaurant in order.suitable_restaurants
+            if restaurant.location and restaurant.location.coordinates
+        ]
+        distances = get_location_distances(location_pairs)
 
         for order in self:
-            order_coordinates = order.location.latitude, order.location.longitude
-            suitable_restaurants_with_distances = []
-
-            for restaurant in order.suitable_restaurants:
-                restaurant_coordinates = (
-                    restaurant.location.latitude,
-                    restaurant.location.longitude,
+            suitable_restaurants_with_distances = [
+                (
+                    restaurant,
+                    distances.get((order.location_id, restaurant.location_id)),
                 )
-                restaurant_distance = distance.distance(
-                    order_coordinates, restaurant_coordinates
-                ).km
-
-                suitable_restaurants_with_distances.append(
-                    (restaurant, restaurant_distance)
-                )
-
+                for restaurant in order.suitable_restaurants
+            ]
+            suitable_restaurants_with_distances.sort(
+                key=lambda entry: (entry[1] is None, entry[1] or 0)
+            )
+            if exact and suitable_restaurants_with_distances:
+                (
+                    nearest_restaurant,
+                    nearest_distance,
+                ) = suitable_restaurants_with_distances[0]
+                if nearest_distance is not None:
+                    suitable_restaurants_with_distances[0] = (
+                        nearest_restaurant,
+                        get_exact_distance(
+                            order.location.coordinates,
+                            nearest_restaurant.location.coordinates,
+                        ),
+                    )
             order.suitable_restaurants_with_distances = (
                 suitable_restaurants_with_distances
             )
 
         return self
 
+    def with_candidates(self):
+        # Restaurants able to cook the orders, nearest first, read from
+        # the `OrderCandidate` table instead of `with_restaurants()`
+        # and `with_distances()`.
+        orders = self.select_related("restaurant").prefetch_related(
+            Prefetch(
+                "candidates",
+                queryset=OrderCandidate.objects.select_related("restaurant").order_by(
+                    F("distance").asc(nulls_last=True), "restaurant_id"
+                ),
+            )
+        )
+        for order in orders:
+            order.suitable_restaurants_with_distances = [
+                (candidate.restaurant, candidate.distance)
+                for candidate in order.candidates.all()
+            ]
+        return orders
+
 
 class Order(models.Model):
     # Order status choices
@@ -226,6 +444,13 @@ class Order(models.Model):
         null=True,
         blank=True,
     )
+    total_price = models.DecimalField(
+        verbose_name="стоимость заказа",
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        validators=[MinValueValidator(0)],
+    )
     comment = models.TextField(
         verbose_name="комментарий",
         max_length=500,
@@ -266,12 +491,25 @@ class Order(models.Model):
         blank=True,
         null=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name="изменён",
+        auto_now=True,
+        db_index=True,
+    )
+    candidates_outdated = models.BooleanField(
+        verbose_name="рестораны нужно подобрать заново",
+        default=True,
+        db_index=True,
+    )
 
     objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = "заказ"
         verbose_name_plural = "заказы"
+        indexes = [
+            models.Index(fields=["status", "registered_at", "id"]),
+        ]
 
     def __str__(self):
         return f"{self.first_name}, {self.address}"
@@ -307,3 +545,64 @@ class OrderProduct(models.Model):
 
     def __str__(self):
         return f"{self.product} - {self.amount}"
+
+
+class OrderCandidate(models.Model):
+    order = models.ForeignKey(
+        to=Order,
+        verbose_name="заказ",
+        related_name="candidates",
+        on_delete=models.CASCADE,
+    )
+    restaurant = models.ForeignKey(
+        to=Restaurant,
+        verbose_name="ресторан",
+        related_name="order_candidates",
+        on_delete=models.CASCADE,
+    )
+    distance = models.FloatField(
+        verbose_name="расстояние, км",
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = "ресторан для заказа"
+        verbose_name_plural = "рестораны для заказов"
+        unique_together = [["order", "restaurant"]]
+
+    def __str__(self):
+        return f"{self.order} — {self.restaurant}"
+
+
+class RestaurantAssignment(models.Model):
+    order = models.OneToOneField(
+        to=Order,
+        verbose_name="заказ",
+        related_name="assignment",
+        on_delete=models.CASCADE,
+    )
+    restaurant = models.ForeignKey(
+        to=Restaurant,
+        verbose_name="ресторан",
+        related_name="assignments",
+        on_delete=models.CASCADE,
+    )
+    distance = models.FloatField(
+        verbose_name="расстояние, км",
+    )
+    restaurant_load = models.PositiveIntegerField(
+        verbose_name="заказов в работе у ресторана",
+    )
+    assigned_at = models.DateTimeField(
+        verbose_name="назначен",
+        default=timezone.now,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = "автоматическое назначение ресторана"
+        verbose_name_plural = "автоматические назначения ресторанов"
+
+    def __str__(self):
+        return f"{self.order} - {self.restaurant}"
@@ -0,0 +1,92 @@
+import gzip
+import hashlib
+import json
+
+import brotli
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date
+
+
+# Content codings in order of preference
+ENCODINGS = {
+    "br": lambda body: brotli.compress(body, quality=11),
+    "gzip": lambda body: gzip.compress(body, compresslevel=9, mtime=0),
+}
+
+
+class JsonPayload:
+    # Pre-rendered JSON body with its validators and compressed variants,
+    # cheap to cache and serve
+
+    def __init__(self, data, last_modified):
+        self.body = json.dumps(
+            data,
+            cls=DjangoJSONEncoder,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+        self.etag_hash = hashlib.sha1(self.body).hexdigest()
+        self.etag = f'"{self.etag_hash}"'
+        self.last_modified = int(last_modified)
+
+        self.encoded_bodies = {}
+        for encoding, compress in ENCODINGS.items():
+            encoded_body = compress(self.body)
+            if len(encoded_body) < len(self.body):
+                self.encoded_bodies[encoding] = encoded_body
+
+    def get_encoded(self, encoding):
+        # Each content coding is a separate representation with its own ETag
+        if encoding is None:
+            return self.body, self.etag
+        return self.encoded_bodies[encoding], f'"{self.etag_hash}-{encoding}"'
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for item in header.split(","):
+        encoding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[encoding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(request, payload):
+    accepted = parse_accept_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    for encoding in ENCODINGS:
+        if encoding not in payload.encoded_bodies:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def payload_response(request, payload):
+    encoding = choose_encoding(request, payload)
+    body, etag = payload.get_encoded(encoding)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=payload.last_modified
+    )
+    if response is None:
+        response = HttpResponse(body, content_type="application/json")
+        if encoding:
+            response["Content-Encoding"] = encoding
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(payload.last_modified)
+    patch_cache_control(response, public=True, no_cache=True)
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
@@ -0,0 +1,179 @@
+from functools import partial
+from weakref import WeakKeyDictionary
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from foodcartapp.candidates import mark_candidates_outdated
+from foodcartapp.catalog import bump_catalog_version
+from foodcartapp.models import (
+    Order,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from foodcartapp.thumbnails import has_image_variants, update_image_variants
+from locations.signals import location_moved
+from locations.spatial import restaurant_grid
+
+
+class PendingChanges:
+    # Changes made in a transaction, applied once when it commits,
+    # however many objects were saved.
+
+    def __init__(self):
+        self.catalog = False
+        self.product_ids = set()
+        self.location_ids = set()
+        self.moved_restaurant_ids = set()
+        self.all_orders = False
+
+    def __call__(self):
+        if self.catalog:
+            bump_catalog_version()
+        if self.product_ids:
+            RestaurantMenuItem.objects.update_availability_rows(self.product_ids)
+        moved_restaurants = Restaurant.objects.filter(
+            id__in=self.moved_restaurant_ids
+        ).select_related("location")
+        for restaurant in moved_restaurants:
+            restaurant_grid.update(
+                restaurant.id,
+                restaurant.location.coordinates if restaurant.location else None,
+            )
+
+        if self.all_orders or self.moved_restaurant_ids:
+            mark_candidates_outdated(Order.objects.unfinished())
+        elif self.product_ids or self.location_ids:
+            mark_candidates_outdated(
+                Order.objects.unfinished().filter(
+                    Q(order_products__product_id__in=self.product_ids)
+                    | Q(location_id__in=self.location_ids)
+                )
+            )
+
+
+# {DB connection: changes of the transaction in progress on it}
+pending_changes = WeakKeyDictionary()
+
+
+def apply_pending_changes(connection):
+    changes = pending_changes.pop(connection, None)
+    if changes is not None:
+        changes()
+
+
+def schedule_changes(
+    catalog=False,
+    product_ids=(),
+    location_ids=(),
+    moved_restaurant_ids=(),
+    all_orders=False,
+):
+    connection = transaction.get_connection()
+    changes = pending_changes.setdefault(connection, PendingChanges())
+    changes.catalog |= catalog
+    changes.product_ids.update(product_ids)
+    changes.location_ids.update(location_ids)
+    changes.moved_restaurant_ids.update(moved_restaurant_ids)
+    changes.all_orders |= all_orders
+
+    # A callback per change, the first one to run applies them all: changes
+    # outlive a callback dropped with a rolled back savepoint. Outside
+    # of a transaction runs right away.
+    transaction.on_commit(partial(apply_pending_changes, connection))
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductCategory)
+def invalidate_catalog(sender, **kwargs):
+    schedule_changes(catalog=True)
+
+
+@receiver(post_save, sender=Product)
+def generate_product_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image:
+        return
+    if has_image_variants(instance.image, instance.image_variants):
+        return
+
+    def generate():
+        # After the commit: files written for a rolled back save would be
+        # left behind, and the image may have changed again meanwhile
+        product = Product.objects.filter(pk=instance.pk).first()
+        if product is None or has_image_variants(product.image, product.image_variants):
+            return
+        try:
+            update_image_variants(product)
+        except OSError:
+            # Missing or broken file: the original image is served as it is
+            return
+        bump_catalog_version()
+
+    transaction.on_commit(generate)
+
+
+@receiver(pre_save, sender=Restaurant)
+def remember_restaurant_location(sender, instance, **kwargs):
+    instance._previous_location_id = (
+        Restaurant.objects.filter(pk=instance.pk)
+        .values_list("location_id", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Restaurant)
+def update_restaurant_grid(sender, instance, **kwargs):
+    # Renaming a restaurant or changing its phone does not affect orders
+    if instance._previous_location_id != instance.location_id:
+        schedule_changes(moved_restaurant_ids=[instance.id])
+
+
+@receiver(post_delete, sender=Restaurant)
+def remove_from_restaurant_grid(sender, instance, **kwargs):
+    transaction.on_commit(lambda: restaurant_grid.remove(instance.id))
+
+
+@receiver(pre_save, sender=RestaurantMenuItem)
+def remember_menu_item(sender, instance, **kwargs):
+    instance._previous_state = (
+        RestaurantMenuItem.objects.filter(pk=instance.pk)
+        .values_list("restaurant_id", "product_id", "availability")
+        .first()
+    )
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+def update_menu_availability(sender, instance, **kwargs):
+    state = (instance.restaurant_id, instance.product_id, instance.availability)
+    if instance._previous_state == state:
+        return
+    # Products whose set of restaurants may have changed
+    product_ids = {
+        product_id
+        for _, product_id, availability in filter(
+            None, [instance._previous_state, state]
+        )
+        if availability
+    }
+    if product_ids:
+        schedule_changes(catalog=True, product_ids=product_ids)
+
+
+@receiver(post_delete, sender=RestaurantMenuItem)
+def remove_menu_availability(sender, instance, **kwargs):
+    if instance.availability:
+        schedule_changes(catalog=True, product_ids=[instance.product_id])
+
+
+@receiver(location_moved)
+def update_located_order_candidates(sender, locations, **kwargs):
+    location_ids = [location.id for location in locations]
+    # A restaurant moved: every unfinished order may be affected
+    if Restaurant.objects.filter(location_id__in=location_ids).exists():
+        schedule_changes(all_orders=True)
+    else:
+        schedule_changes(location_ids=location_ids)
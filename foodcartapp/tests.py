@@ -0,0 +1,781 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from PIL import Image, features
+
+from foodcartapp import catalog, signals
+from foodcartapp.assignment import assign_restaurants
+from foodcartapp.candidates import (
+    update_order_candidates,
+    update_outdated_order_candidates,
+)
+from foodcartapp.catalog import (
+    CATALOG_VERSION,
+    bump_catalog_version,
+    get_catalog_payload,
+    get_catalog_version,
+)
+from foodcartapp.menu_index import MenuIndex, iter_bits, to_mask
+from foodcartapp.models import (
+    CacheVersion,
+    Order,
+    OrderCandidate,
+    OrderProduct,
+    Product,
+    Restaurant,
+    RestaurantAssignment,
+    RestaurantMenuItem,
+    read_versions,
+)
+from foodcartapp.payloads import JsonPayload, payload_response
+from foodcartapp.signals import schedule_changes
+from foodcartapp.thumbnails import get_image_srcsets
+from foodcartapp.views import create_orders, register_order_async, validate_order
+from locations.geocoding import location_cache, save_geocoded_locations
+from locations.models import GeocodingTask, Location
+from locations.spatial import GRID_VERSION, restaurant_grid
+from star_burger.cache_url import CACHE_NAMESPACES
+
+
+def clear_caches():
+    # Process-level caches outlive the test transactions
+    read_versions.clear()
+    signals.pending_changes.clear()
+    catalog.products_snapshot = (None, {}, set())
+    location_cache.locations.clear()
+    for namespace in CACHE_NAMESPACES:
+        caches[namespace].clear()
+
+
+class MenuIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.menu_index = MenuIndex(
+            {
+                1: to_mask([1, 2, 5]),
+                2: to_mask([2, 5, 70]),
+                3: to_mask([70]),
+            }
+        )
+
+    def test_masks(self):
+        self.assertEqual(list(iter_bits(to_mask([0, 3, 64, 200]))), [0, 3, 64, 200])
+        self.assertEqual(self.menu_index.restaurant_ids, [1, 2, 5, 70])
+
+    def test_finds_restaurants_having_every_product(self):
+        self.assertEqual(self.menu_index.find_restaurant_ids([1, 2]), [2, 5])
+        self.assertEqual(self.menu_index.find_restaurant_ids([2, 3]), [70])
+        self.assertEqual(self.menu_index.find_restaurant_ids([1, 3]), [])
+
+    def test_unknown_product(self):
+        self.assertEqual(self.menu_index.find_restaurant_ids([1, 4]), [])
+
+    def test_restaurants_mask(self):
+        self.assertEqual(
+            self.menu_index.find_restaurant_ids([2], to_mask([5, 70, 100])), [5, 70]
+        )
+        self.assertEqual(self.menu_index.find_restaurant_ids([1], 0), [])
+
+
+class PayloadResponseTest(SimpleTestCase):
+    def setUp(self):
+        self.payload = JsonPayload(
+            [{"name": "Бургер", "price": 100}] * 100, last_modified=1_600_000_000
+        )
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        return payload_response(self.factory.get("/", **headers), self.payload)
+
+    def test_prefers_brotli(self):
+        response = self.get(HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response.content, self.payload.encoded_bodies["br"])
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_respects_quality(self):
+        response = self.get(HTTP_ACCEPT_ENCODING="br;q=0, gzip;q=0.5")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        response = self.get(HTTP_ACCEPT_ENCODING="*;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, self.payload.body)
+
+    def test_identity(self):
+        response = self.get()
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(json.loads(response.content)[0]["name"], "Бургер")
+
+    def test_etag_per_encoding(self):
+        identity_etag = self.get()["ETag"]
+        gzip_etag = self.get(HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        self.assertNotEqual(identity_etag, gzip_etag)
+
+    def test_not_modified(self):
+        etag = self.get(HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        response = self.get(HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        # Another representation is sent in full
+        response = self.get(HTTP_ACCEPT_ENCODING="br", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        # As if committed: caches and the grid are updated
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_catalog()
+
+    def create_catalog(self):
+        self.burger = Product.objects.create(
+            name="Бургер", price=Decimal("100.00"), image="burger.png"
+        )
+        self.fries = Product.objects.create(
+            name="Картошка", price=Decimal("50.00"), image="fries.png"
+        )
+        self.near_location = Location.objects.create(
+            address="Ближний", latitude=Decimal("55.750"), longitude=Decimal("37.620")
+        )
+        self.far_location = Location.objects.create(
+            address="Дальний", latitude=Decimal("55.800"), longitude=Decimal("37.620")
+        )
+        self.near_restaurant = Restaurant.objects.create(
+            name="Ближний", location=self.near_location
+        )
+        self.far_restaurant = Restaurant.objects.create(
+            name="Дальний", location=self.far_location
+        )
+        for restaurant in (self.near_restaurant, self.far_restaurant):
+            for product in (self.burger, self.fries):
+                RestaurantMenuItem.objects.create(
+                    restaurant=restaurant, product=product
+                )
+
+    def create_order(self, products, **fields):
+        order = Order.objects.create(
+            **{
+                "first_name": "Иван",
+                "last_name": "Иванов",
+                "phone_number": "+79161234567",
+                "address": self.near_location.address,
+                "location": self.near_location,
+                **fields,
+            }
+        )
+        for product, amount in products:
+            OrderProduct.objects.create(
+                order=order,
+                product=product,
+                amount=amount,
+                static_price=product.price * amount,
+            )
+        return order
+
+
+class ProductListApiTest(CatalogTestCase):
+    def test_not_modified(self):
+        response = self.client.get("/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {product["name"] for product in json.loads(response.content)},
+            {"Бургер", "Картошка"},
+        )
+        response = self.client.get(
+            "/api/products/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class CatalogInvalidationTest(CatalogTestCase):
+    def get_product_names(self):
+        return {product["name"] for product in json.loads(get_catalog_payload().body)}
+
+    def test_serves_cached_payload(self):
+        payload = get_catalog_payload()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_catalog_payload().body, payload.body)
+
+    def test_product_changes_bump_version(self):
+        self.get_product_names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.burger.name = "Чизбургер"
+            self.burger.save()
+        self.assertEqual(self.get_product_names(), {"Чизбургер", "Картошка"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fries.delete()
+        self.assertEqual(self.get_product_names(), {"Чизбургер"})
+
+    def test_menu_changes_bump_version(self):
+        self.get_product_names()
+        with self.captureOnCommitCallbacks(execute=True):
+            for menu_item in RestaurantMenuItem.objects.filter(product=self.fries):
+                menu_item.availability = False
+                menu_item.save()
+        self.assertEqual(self.get_product_names(), {"Бургер"})
+
+    def test_other_processes_see_bumped_version(self):
+        version = get_catalog_version()
+        # Another worker changes the catalog
+        CacheVersion.objects.filter(name=CATALOG_VERSION).update(version=version + 1)
+        self.assertEqual(get_catalog_version(), version)
+        read_versions.clear()
+        self.assertEqual(get_catalog_version(), version + 1)
+
+        bump_catalog_version()
+        self.assertGreater(get_catalog_version(), version + 1)
+
+
+class OrderValidationTest(CatalogTestCase):
+    def get_order_data(self, *product_ids):
+        return {
+            "firstname": "Иван",
+            "lastname": "Иванов",
+            "phonenumber": "+79161234567",
+            "address": "Москва, Тверская, 1",
+            "products": [
+                {"product": product_id, "quantity": 2} for product_id in product_ids
+            ],
+        }
+
+    def test_validates_products_from_snapshot(self):
+        validate_order(self.get_order_data(self.burger.id))
+        with self.assertNumQueries(0):
+            serializer = validate_order(
+                self.get_order_data(self.burger.id, self.fries.id)
+            )
+        self.assertEqual(serializer.errors, {})
+
+    def test_unknown_and_unavailable_products(self):
+        RestaurantMenuItem.objects.filter(product=self.fries).update(availability=False)
+        bump_catalog_version()
+        errors = validate_order(self.get_order_data(0, self.fries.id)).errors
+        self.assertIn("0", str(errors["products"][0]))
+        self.assertEqual(
+            errors["products"][1]["product"], ["Товар «Картошка» сейчас недоступен."]
+        )
+
+    def test_charges_current_prices(self):
+        validate_order(self.get_order_data(self.burger.id))
+        # Changed by another process, the snapshot is not renewed yet
+        Product.objects.filter(pk=self.burger.pk).update(price=Decimal("120.00"))
+        serializer = validate_order(self.get_order_data(self.burger.id))
+        [order] = create_orders([serializer.validated_data])
+        self.assertEqual(order.total_price, Decimal("240.00"))
+        self.assertEqual(order.order_products.get().static_price, Decimal("240.00"))
+
+
+class RegisterOrdersBulkTest(CatalogTestCase):
+    def get_order_data(self, **fields):
+        return {
+            "firstname": "Иван",
+            "lastname": "Иванов",
+            "phonenumber": "+79161234567",
+            "address": "Москва, Тверская, 1",
+            "products": [
+                {"product": self.burger.id, "quantity": 2},
+                {"product": self.fries.id, "quantity": 1},
+            ],
+            **fields,
+        }
+
+    def post(self, data):
+        return self.client.post(
+            "/api/orders/bulk/", json.dumps(data), content_type="application/json"
+        )
+
+    def test_mixed_orders(self):
+        response = self.post(
+            [
+                self.get_order_data(),
+                self.get_order_data(phonenumber="не телефон"),
+                self.get_order_data(products=[]),
+                self.get_order_data(address="Москва, Арбат, 2"),
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(len(results), 4)
+        self.assertIn("phonenumber", results[1]["errors"])
+        self.assertIn("products", results[2]["errors"])
+
+        orders = Order.objects.in_bulk([results[0]["id"], results[3]["id"]])
+        self.assertEqual(len(orders), 2)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(orders[results[3]["id"]].address, "Москва, Арбат, 2")
+        for order in orders.values():
+            self.assertEqual(order.total_price, Decimal("250.00"))
+            self.assertTrue(order.candidates_outdated)
+        # Unknown addresses wait for the geocoding worker
+        self.assertEqual(GeocodingTask.objects.count(), 2)
+
+    def test_not_a_list(self):
+        response = self.post(self.get_order_data())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_all_invalid(self):
+        response = self.post([self.get_order_data(products=[{"product": 0}])])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("errors", response.json()[0])
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class RecalculateTotalPricesTest(CatalogTestCase):
+    def test_recalculates_changed_orders_only(self):
+        changed_order = self.create_order([(self.burger, 2)])
+        unchanged_order = self.create_order([(self.fries, 1)])
+        Order.objects.update(total_price=Decimal("50.00"))
+
+        self.assertEqual(Order.objects.recalculate_total_prices(), 1)
+        changed_order.refresh_from_db()
+        unchanged_order.refresh_from_db()
+        self.assertEqual(changed_order.total_price, Decimal("200.00"))
+        self.assertEqual(unchanged_order.total_price, Decimal("50.00"))
+
+        OrderProduct.objects.filter(order=changed_order).delete()
+        self.assertEqual(Order.objects.recalculate_total_prices(), 1)
+        changed_order.refresh_from_db()
+        self.assertEqual(changed_order.total_price, Decimal("0.00"))
+        self.assertEqual(Order.objects.recalculate_total_prices(), 0)
+
+
+class AssignRestaurantsTest(CatalogTestCase):
+    def create_order_with_candidates(self, **fields):
+        order = self.create_order([(self.burger, 1)], **fields)
+        OrderCandidate.objects.bulk_create(
+            [
+                OrderCandidate(
+                    order=order, restaurant=self.near_restaurant, distance=1
+                ),
+                OrderCandidate(order=order, restaurant=self.far_restaurant, distance=3),
+            ]
+        )
+        return order
+
+    def test_assigns_nearest_restaurant(self):
+        order = self.create_order_with_candidates()
+        assignments = assign_restaurants()
+        self.assertEqual([assignment.order for assignment in assignments], [order])
+        order.refresh_from_db()
+        self.assertEqual(order.restaurant, self.near_restaurant)
+        assignment = RestaurantAssignment.objects.get(order=order)
+        self.assertEqual(assignment.distance, 1)
+        self.assertEqual(assignment.restaurant_load, 0)
+
+        # Assigned orders are left alone
+        self.assertEqual(assign_restaurants(), [])
+
+    @override_settings(ASSIGNMENT_LOAD_PENALTY_KM=1.5)
+    def test_accounts_for_restaurant_load(self):
+        self.create_order(
+            [(self.fries, 1)], status=Order.COOKING, restaurant=self.near_restaurant
+        )
+        first_order = self.create_order_with_candidates()
+        second_order = self.create_order_with_candidates()
+        assign_restaurants()
+        first_order.refresh_from_db()
+        second_order.refresh_from_db()
+        # 1 km + 1.5 km for the order being cooked is still nearer than 3 km,
+        # but not with the first order assigned as well
+        self.assertEqual(first_order.restaurant, self.near_restaurant)
+        self.assertEqual(second_order.restaurant, self.far_restaurant)
+
+    def test_skips_orders_without_candidates_or_coordinates(self):
+        without_candidates = self.create_order([(self.burger, 1)])
+        not_located = self.create_order_with_candidates(location=None)
+        confirmed = self.create_order_with_candidates(status=Order.CONFIRMED)
+        self.assertEqual(assign_restaurants(), [])
+        for order in (without_candidates, not_located, confirmed):
+            order.refresh_from_db()
+            self.assertIsNone(order.restaurant)
+
+    def test_leaves_unassigned_by_manager_orders_alone(self):
+        order = self.create_order_with_candidates()
+        other_order = self.create_order_with_candidates()
+        assign_restaurants(Order.objects.filter(pk=order.pk))
+        Order.objects.filter(pk=order.pk).update(restaurant=None)
+
+        # The sweep does not fail on the existing assignment
+        assignments = assign_restaurants()
+        self.assertEqual(
+            [assignment.order for assignment in assignments], [other_order]
+        )
+        order.refresh_from_db()
+        self.assertIsNone(order.restaurant)
+
+
+class AssignRestaurantsConcurrencyTest(TransactionTestCase):
+    # Only databases with row locks can run it, PostgreSQL for one
+
+    @skipUnlessDBFeature("has_select_for_update_skip_locked")
+    def test_skips_locked_orders(self):
+        clear_caches()
+        location = Location.objects.create(
+            address="Адрес", latitude=Decimal("55.750"), longitude=Decimal("37.620")
+        )
+        restaurant = Restaurant.objects.create(name="Ресторан", location=location)
+        orders = [
+            Order.objects.create(
+                first_name="Иван",
+                last_name="Иванов",
+                phone_number="+79161234567",
+                address=location.address,
+                location=location,
+            )
+            for _ in range(2)
+        ]
+        OrderCandidate.objects.bulk_create(
+            [
+                OrderCandidate(order=order, restaurant=restaurant, distance=1)
+                for order in orders
+            ]
+        )
+
+        assignments = []
+
+        def assign():
+            try:
+                assignments.extend(assign_restaurants())
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Another sweep is busy with the first order
+            list(Order.objects.filter(pk=orders[0].pk).select_for_update())
+            thread = threading.Thread(target=assign)
+            thread.start()
+            thread.join(timeout=10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([assignment.order for assignment in assignments], [orders[1]])
+
+
+class RestaurantGridTest(CatalogTestCase):
+    def find_nearest(self, radius_km, **kwargs):
+        return [
+            restaurant_id
+            for restaurant_id, _ in restaurant_grid.find_nearest(
+                (Decimal("55.750"), Decimal("37.620")), radius_km, **kwargs
+            )
+        ]
+
+    def test_finds_restaurants_within_radius(self):
+        self.assertEqual(self.find_nearest(3), [self.near_restaurant.id])
+        self.assertEqual(
+            self.find_nearest(10), [self.near_restaurant.id, self.far_restaurant.id]
+        )
+        self.assertEqual(self.find_nearest(10, limit=1), [self.near_restaurant.id])
+
+    def test_follows_moved_restaurants(self):
+        self.find_nearest(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.far_restaurant.location = self.near_location
+            self.far_restaurant.save()
+        self.assertEqual(
+            set(self.find_nearest(3)),
+            {self.near_restaurant.id, self.far_restaurant.id},
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.near_location.latitude = Decimal("56.000")
+            self.near_location.save()
+        self.assertEqual(self.find_nearest(3), [])
+
+    def test_follows_bulk_geocoded_restaurants(self):
+        self.find_nearest(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            save_geocoded_locations({self.far_location.address: ("55.76", "37.62")})
+        self.assertEqual(
+            set(self.find_nearest(3)),
+            {self.near_restaurant.id, self.far_restaurant.id},
+        )
+
+    def test_picks_up_changes_of_other_processes(self):
+        self.find_nearest(3)
+        # Another process moves a restaurant
+        Restaurant.objects.filter(pk=self.far_restaurant.pk).update(
+            location=self.near_location
+        )
+        CacheVersion.objects.filter(name=GRID_VERSION).update(version=0)
+        self.assertEqual(self.find_nearest(3), [self.near_restaurant.id])
+        restaurant_grid.refresh(max_age=0)
+        self.assertEqual(
+            set(self.find_nearest(3)),
+            {self.near_restaurant.id, self.far_restaurant.id},
+        )
+
+
+class OrderCandidatesTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.burger_order = self.create_order([(self.burger, 1)])
+        self.fries_order = self.create_order([(self.fries, 1)])
+        update_outdated_order_candidates()
+
+    def get_candidates(self, order):
+        return [
+            (candidate.restaurant, round(candidate.distance, 2))
+            for candidate in order.candidates.order_by("distance")
+        ]
+
+    def get_outdated_orders(self):
+        return set(Order.objects.filter(candidates_outdated=True))
+
+    def test_computes_outdated_candidates(self):
+        self.assertEqual(
+            self.get_candidates(self.burger_order),
+            [(self.near_restaurant, 0), (self.far_restaurant, 5.56)],
+        )
+        self.assertEqual(self.get_outdated_orders(), set())
+
+    def test_touches_changed_orders_only(self):
+        updated_at = Order.objects.get(pk=self.burger_order.pk).updated_at
+        self.assertEqual(update_order_candidates(Order.objects.all()), 2)
+        self.assertEqual(
+            Order.objects.get(pk=self.burger_order.pk).updated_at, updated_at
+        )
+
+        RestaurantMenuItem.objects.filter(
+            product=self.burger, restaurant=self.near_restaurant
+        ).update(availability=False)
+        RestaurantMenuItem.objects.update_availability_rows([self.burger.id])
+        update_order_candidates(Order.objects.all())
+        self.assertEqual(
+            self.get_candidates(self.burger_order), [(self.far_restaurant, 5.56)]
+        )
+        self.assertGreater(
+            Order.objects.get(pk=self.burger_order.pk).updated_at, updated_at
+        )
+
+    def test_menu_changes_mark_orders_with_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item = RestaurantMenuItem.objects.get(
+                product=self.fries, restaurant=self.far_restaurant
+            )
+            menu_item.availability = False
+            menu_item.save()
+        self.assertEqual(self.get_outdated_orders(), {self.fries_order})
+
+        update_outdated_order_candidates()
+        self.assertEqual(
+            self.get_candidates(self.fries_order), [(self.near_restaurant, 0)]
+        )
+
+    def test_moved_order_location_marks_its_orders(self):
+        other_location = Location.objects.create(
+            address="Другой", latitude=Decimal("55.700"), longitude=Decimal("37.620")
+        )
+        other_order = self.create_order([(self.fries, 1)], location=other_location)
+        update_outdated_order_candidates()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other_location.latitude = Decimal("55.850")
+            other_location.save()
+        self.assertEqual(self.get_outdated_orders(), {other_order})
+
+    def test_moved_restaurant_marks_all_orders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.far_location.latitude = Decimal("55.850")
+            self.far_location.save()
+        self.assertEqual(
+            self.get_outdated_orders(), {self.burger_order, self.fries_order}
+        )
+
+        update_outdated_order_candidates()
+        self.assertEqual(
+            self.get_candidates(self.burger_order),
+            [(self.near_restaurant, 0), (self.far_restaurant, 11.12)],
+        )
+
+    def test_unchanged_menu_item_marks_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.get(
+                product=self.fries, restaurant=self.far_restaurant
+            ).save()
+        self.assertEqual(self.get_outdated_orders(), set())
+
+
+@mock.patch("locations.geocoding.fetch_coordinates_async")
+class RegisterOrderAsyncTest(CatalogTestCase):
+    def post(self, **fields):
+        data = {
+            "firstname": "Иван",
+            "lastname": "Иванов",
+            "phonenumber": "+79161234567",
+            "address": "Москва, Тверская, 1",
+            "products": [{"product": self.burger.id, "quantity": 1}],
+            **fields,
+        }
+        request = AsyncRequestFactory().post(
+            "/api/order/", json.dumps(data), content_type="application/json"
+        )
+        return async_to_sync(register_order_async)(request)
+
+    def test_geocodes_address_right_away(self, fetch_coordinates_async):
+        fetch_coordinates_async.return_value = ("55.75", "37.62")
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(
+            order.location.coordinates, (Decimal("55.750"), Decimal("37.620"))
+        )
+        self.assertFalse(GeocodingTask.objects.exists())
+
+    def test_queues_address_when_geocoder_fails(self, fetch_coordinates_async):
+        for error in [requests.ConnectionError, asyncio.TimeoutError, KeyError]:
+            fetch_coordinates_async.side_effect = error
+            with mock.patch("foodcartapp.views.rollbar"):
+                self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertIsNone(Order.objects.first().location.coordinates)
+        self.assertEqual(GeocodingTask.objects.count(), 1)
+
+    def test_invalid_order(self, fetch_coordinates_async):
+        response = self.post(products=[])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("products", json.loads(response.content))
+        fetch_coordinates_async.assert_not_called()
+        self.assertFalse(Order.objects.exists())
+
+    def test_located_address_outdates_waiting_orders(self, fetch_coordinates_async):
+        fetch_coordinates_async.side_effect = requests.ConnectionError
+        self.post()
+        update_outdated_order_candidates()
+        waiting_order = Order.objects.get()
+        self.assertEqual(self.get_candidate_distances(waiting_order), [None, None])
+
+        fetch_coordinates_async.side_effect = None
+        fetch_coordinates_async.return_value = ("55.75", "37.62")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post()
+        waiting_order.refresh_from_db()
+        self.assertTrue(waiting_order.candidates_outdated)
+        update_outdated_order_candidates()
+        self.assertEqual(self.get_candidate_distances(waiting_order), [0, 5.56])
+
+    def get_candidate_distances(self, order):
+        return sorted(
+            (
+                candidate.distance and round(candidate.distance, 2)
+                for candidate in order.candidates.all()
+            ),
+            key=lambda distance: (distance is None, distance),
+        )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, ignore_errors=True)
+
+    def make_image(self, name, image_format, size=(700, 350)):
+        image_file = BytesIO()
+        Image.new("RGB", size, "red").save(image_file, image_format)
+        return SimpleUploadedFile(name, image_file.getvalue())
+
+    def create_product(self, *args, **kwargs):
+        return Product.objects.create(
+            name="Бургер",
+            price=Decimal("100.00"),
+            image=self.make_image(*args, **kwargs),
+        )
+
+    def get_variants(self, product):
+        product.refresh_from_db()
+        return sorted(
+            (variant["width"], variant["type"])
+            for variant in product.image_variants["variants"]
+        )
+
+    def test_generates_downsized_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product("burger.png", "PNG")
+        widths = [100, 300, 600]
+        expected_variants = [(width, "image/png") for width in widths]
+        if features.check("webp"):
+            expected_variants += [(width, "image/webp") for width in [*widths, 700]]
+        self.assertEqual(self.get_variants(product), sorted(expected_variants))
+        self.assertEqual(product.image_variants["type"], "image/png")
+        self.assertEqual(product.image_variants["width"], 700)
+        srcsets = get_image_srcsets(product.image, product.image_variants)
+        self.assertTrue(srcsets["image/png"].endswith("burger.png 700w"))
+
+    def test_converts_other_formats_to_png(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product("burger.gif", "GIF", size=(200, 100))
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants["type"], "image/gif")
+        self.assertIn((100, "image/png"), self.get_variants(product))
+        self.assertIn((200, "image/png"), self.get_variants(product))
+
+    def test_replaced_image_variants_are_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product("burger.png", "PNG")
+        product.refresh_from_db()
+        old_names = [variant["name"] for variant in product.image_variants["variants"]]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self.make_image("fries.jpg", "JPEG")
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants["type"], "image/jpeg")
+        for name in old_names:
+            self.assertFalse(product.image.storage.exists(name))
+
+    def test_rolled_back_save_leaves_no_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                product = self.create_product("burger.png", "PNG")
+                transaction.set_rollback(True)
+        self.assertEqual(
+            os.listdir(os.path.join(settings.MEDIA_ROOT)), [product.image.name]
+        )
+
+
+@mock.patch("foodcartapp.signals.bump_catalog_version")
+class ScheduleChangesTest(TestCase):
+    def test_applies_changes_once_on_commit(self, bump_catalog_version):
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_changes(catalog=True)
+            schedule_changes(catalog=True)
+            bump_catalog_version.assert_not_called()
+        bump_catalog_version.assert_called_once_with()
+
+    def test_changes_of_next_transaction(self, bump_catalog_version):
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_changes(catalog=True)
+        self.assertEqual(bump_catalog_version.call_count, 2)
+
+    def test_survives_rolled_back_savepoint(self, bump_catalog_version):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                schedule_changes(location_ids=[0])
+                transaction.set_rollback(True)
+            schedule_changes(catalog=True)
+        bump_catalog_version.assert_called_once_with()
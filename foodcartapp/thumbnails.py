@@ -0,0 +1,121 @@
+import os
+from collections import defaultdict
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from foodcartapp.models import Product
+
+THUMBNAIL_WIDTHS = (100, 300, 600)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def get_variant_name(name, width, image_format):
+    stem, _ = os.path.splitext(name)
+    return f"{stem}.{width}w.{EXTENSIONS[image_format]}"
+
+
+def save_variant(storage, name, image, image_format):
+    buffer = BytesIO()
+    if image_format == "JPEG":
+        image.convert("RGB").save(
+            buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+        )
+    elif image_format == "WEBP":
+        image.save(buffer, "WEBP", quality=WEBP_QUALITY, method=6)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    storage.delete(name)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_image_variants(image_file):
+    # Save downsized copies of the image next to it, in its own format
+    # and in WebP if Pillow supports it. Images in other formats, like GIF,
+    # get PNG copies, the full-size one included. Returns the description
+    # kept in `Product.image_variants`.
+    image_file.open("rb")
+    try:
+        with Image.open(image_file) as image:
+            source_format = image.format
+            source_type = Image.MIME.get(source_format, "application/octet-stream")
+            image = ImageOps.exif_transpose(image)
+    finally:
+        image_file.close()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.mode in ("LA", "P") else "RGB")
+
+    formats = [source_format if source_format in ("JPEG", "PNG") else "PNG"]
+    if features.check("webp"):
+        formats.append("WEBP")
+    widths = [width for width in THUMBNAIL_WIDTHS if width < image.width]
+
+    variants = []
+    for width in [*widths, image.width]:
+        resized_image = image.resize(
+            (width, max(1, round(image.height * width / image.width))),
+            Image.LANCZOS,
+        )
+        for image_format in formats:
+            if width == image.width and image_format == source_format:
+                # The original itself
+                continue
+            name = save_variant(
+                image_file.storage,
+                get_variant_name(image_file.name, width, image_format),
+                resized_image,
+                image_format,
+            )
+            variants.append(
+                {"name": name, "width": width, "type": MIME_TYPES[image_format]}
+            )
+
+    return {
+        "source": image_file.name,
+        "type": source_type,
+        "width": image.width,
+        "height": image.height,
+        "variants": variants,
+    }
+
+
+def delete_image_variants(storage, image_variants, keep=None):
+    kept_names = {variant["name"] for variant in (keep or {}).get("variants", [])}
+    for variant in image_variants.get("variants", []):
+        if variant["name"] not in kept_names:
+            storage.delete(variant["name"])
+
+
+def update_image_variants(product):
+    image_variants = generate_image_variants(product.image)
+    delete_image_variants(
+        product.image.storage, product.image_variants, keep=image_variants
+    )
+    product.image_variants = image_variants
+    Product.objects.filter(pk=product.pk).update(image_variants=image_variants)
+
+
+def has_image_variants(image_file, image_variants):
+    return bool(image_file) and image_variants.get("source") == image_file.name
+
+
+def get_image_srcsets(image_file, image_variants):
+    # {MIME type: srcset}, the original image included. Empty until
+    # the variants of the current image are generated.
+    if not has_image_variants(image_file, image_variants):
+        return {}
+
+    candidates = defaultdict(list)
+    candidates[image_variants["type"]].append((image_variants["width"], image_file.url))
+    for variant in image_variants["variants"]:
+        candidates[variant["type"]].append(
+            (variant["width"], image_file.storage.url(variant["name"]))
+        )
+    return {
+        mime_type: ", ".join(f"{url} {width}w" for width, url in sorted(urls))
+        for mime_type, urls in candidates.items()
+    }
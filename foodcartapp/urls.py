@@ -1,11 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import banners_list_api, product_list_api, register_order
+from .views import (
+    banners_list_api,
+    product_list_api,
+    register_order,
+    register_order_async,
+    register_orders_bulk,
+)
 
 app_name = "foodcartapp"
 
 urlpatterns = [
-    path("products/", product_list_api),
-    path("banners/", banners_list_api),
-    path("order/", register_order),
+    path("products/", product_list_api, name="product_list_api"),
+    path("banners/", banners_list_api, name="banners_list_api"),
+    path(
+        "order/",
+        register_order_async if settings.ASYNC_ORDER_INTAKE else register_order,
+        name="register_order",
+    ),
+    path("orders/bulk/", register_orders_bulk, name="register_orders_bulk"),
 ]
@@ -1,80 +1,93 @@
+import asyncio
+import json
+import time
+from functools import lru_cache
+
+import requests
+import rollbar
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.templatetags.static import static
 from phonenumber_field.serializerfields import PhoneNumberField
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from rest_framework.serializers import CharField, IntegerField, ModelSerializer
-
+from rest_framework.serializers import (
+    CharField,
+    IntegerField,
+    ModelSerializer,
+    PrimaryKeyRelatedField,
+)
+
+from foodcartapp.catalog import get_catalog_payload, get_products_snapshot
 from foodcartapp.models import Order, OrderProduct, Product
-from locations.geocoding import fetch_coordinates
-from locations.models import Location
+from foodcartapp.payloads import JsonPayload, payload_response
+from locations.geocoding import (
+    close_async_client,
+    get_location_async,
+    normalize_address,
+    request_locations,
+)
 
+MAX_BULK_ORDERS = 500
 
-def banners_list_api(request):
+
+@lru_cache(maxsize=None)
+def get_banners_payload():
     # FIXME move data to db?
-    return JsonResponse(
-        [
-            {
-                "title": "Burger",
-                "src": static("burger.jpg"),
-                "text": "Tasty Burger at your door step",
-            },
-            {
-                "title": "Spices",
-                "src": static("food.jpg"),
-                "text": "All Cuisines",
-            },
-            {
-                "title": "New York",
-                "src": static("tasty.jpg"),
-                "text": "Food is incomplete without a tasty dessert",
-            },
-        ],
-        safe=False,
-        json_dumps_params={
-            "ensure_ascii": False,
-            "indent": 4,
+    banners = [
+        {
+            "title": "Burger",
+            "src": static("burger.jpg"),
+            "text": "Tasty Burger at your door step",
         },
-    )
+        {
+            "title": "Spices",
+            "src": static("food.jpg"),
+            "text": "All Cuisines",
+        },
+        {
+            "title": "New York",
+            "src": static("tasty.jpg"),
+            "text": "Food is incomplete without a tasty dessert",
+        },
+    ]
+    return JsonPayload(banners, last_modified=time.time())
+
+
+def banners_list_api(request):
+    return payload_response(request, get_banners_payload())
 
 
 def product_list_api(request):
-    products = Product.objects.select_related("category").available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            "id": product.id,
-            "name": product.name,
-            "price": product.price,
-            "special_status": product.special_status,
-            "description": product.description,
-            "category": {
-                "id": product.category.id,
-                "name": product.category.name,
-            }
-            if product.category
-            else None,
-            "image": product.image.url,
-            "restaurant": {
-                "id": product.id,
-                "name": product.name,
-            },
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(
-        dumped_products,
-        safe=False,
-        json_dumps_params={
-            "ensure_ascii": False,
-            "indent": 4,
-        },
-    )
+    return payload_response(request, get_catalog_payload())
+
+
+class ProductField(PrimaryKeyRelatedField):
+    # Resolves products from the in-process catalog snapshot
+    # instead of querying them one by one.
+    default_error_messages = {
+        "unavailable": "Товар «{name}» сейчас недоступен.",
+    }
+
+    def to_internal_value(self, data):
+        products, available_product_ids = get_products_snapshot()
+        try:
+            product = products[int(data)]
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if product.id not in available_product_ids:
+            self.fail("unavailable", name=product.name)
+        return product
 
 
 class OrderProductSerializer(ModelSerializer):
+    product = ProductField(queryset=Product.objects.all())
     quantity = IntegerField(source="amount")
 
     class Meta:
@@ -100,37 +113,140 @@ class OrderSerializer(ModelSerializer):
 
 
 @transaction.atomic
+def create_orders(orders_data):
+    places = request_locations(order_data["address"] for order_data in orders_data)
+    # The catalog snapshot may lag behind a price change made in another
+    # process, so orders are charged the prices from the DB
+    prices = dict(
+        Product.objects.filter(
+            id__in={
+                product["product"].id
+                for order_data in orders_data
+                for product in order_data["products"]
+            }
+        ).values_list("id", "price")
+    )
+
+    orders = []
+    order_products_instances = []
+    for order_data in orders_data:
+        order = Order(
+            first_name=order_data["first_name"],
+            last_name=order_data["last_name"],
+            phone_number=order_data["phone_number"],
+            address=order_data["address"],
+            location=places[normalize_address(order_data["address"])],
+        )
+        order_products = [
+            OrderProduct(
+                order=order,
+                product=product["product"],
+                amount=product["amount"],
+                static_price=prices[product["product"].id] * product["amount"],
+            )
+            for product in order_data["products"]
+        ]
+        order.total_price = sum(
+            order_product.static_price for order_product in order_products
+        )
+        orders.append(order)
+        order_products_instances.extend(order_products)
+
+    Order.objects.bulk_create(orders)
+    OrderProduct.objects.bulk_create(order_products_instances)
+
+    # Candidates and restaurants are left to the `assign_restaurants` sweep:
+    # new orders are created with their candidates outdated
+    return orders
+
+
 @api_view(["POST"])
 def register_order(request):
     serializer = OrderSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
 
-    order_address = serializer.validated_data["address"]
+    create_orders([serializer.validated_data])
+
+    return Response(data=serializer.data, status=status.HTTP_200_OK)
 
-    latitude, longitude = fetch_coordinates(order_address)
-    place, created = Location.objects.get_or_create(
-        address=order_address,
-        longitude=longitude,
-        latitude=latitude,
-    )
-    order = Order.objects.create(
-        first_name=serializer.validated_data["first_name"],
-        last_name=serializer.validated_data["last_name"],
-        phone_number=serializer.validated_data["phone_number"],
-        address=order_address,
-        location=place,
-    )
 
-    order_products = serializer.validated_data["products"]
-    order_products_instances = [
-        OrderProduct(
-            order=order,
-            product=product["product"],
-            amount=product["amount"],
-            static_price=product["product"].price * product["amount"],
+def validate_order(data):
+    serializer = OrderSerializer(data=data)
+    serializer.is_valid()
+    return serializer
+
+
+async def register_order_async(request):
+    # `register_order` for ASGI servers. While the geocoder is awaited the
+    # process keeps serving other requests, so the address is geocoded right
+    # away instead of in the queue, unless the geocoder is slow or failing.
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        data = json.loads(request.body)
+    except ValueError as error:
+        return JsonResponse({"detail": f"JSON parse error - {error}"}, status=400)
+
+    serializer = await sync_to_async(validate_order)(data)
+    if serializer.errors:
+        return JsonResponse(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={"ensure_ascii": False},
         )
-        for product in order_products
-    ]
-    OrderProduct.objects.bulk_create(order_products_instances)
 
-    return Response(data=serializer.data, status=status.HTTP_200_OK)
+    try:
+        await asyncio.wait_for(
+            get_location_async(serializer.validated_data["address"]),
+            timeout=settings.ORDER_GEOCODING_TIMEOUT,
+        )
+    except (asyncio.TimeoutError, requests.RequestException):
+        # `create_orders` queues the address for the geocoding worker
+        pass
+    except Exception:
+        # The order is saved whatever goes wrong with the geocoding
+        rollbar.report_exc_info()
+    finally:
+        if not isinstance(request, ASGIRequest):
+            # Under WSGI every request runs in an event loop of its own
+            await close_async_client()
+    await sync_to_async(create_orders)([serializer.validated_data])
+
+    return JsonResponse(serializer.data, json_dumps_params={"ensure_ascii": False})
+
+
+# Not `csrf_exempt`: in Django 4.0 it hides that the view is async
+register_order_async.csrf_exempt = True
+
+
+@api_view(["POST"])
+def register_orders_bulk(request):
+    if not isinstance(request.data, list):
+        return Response(
+            data={"detail": "Ожидается список заказов."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(request.data) > MAX_BULK_ORDERS:
+        return Response(
+            data={"detail": f"Не больше {MAX_BULK_ORDERS} заказов за один запрос."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    results = []
+    valid_serializers = []
+    for order_data in request.data:
+        serializer = OrderSerializer(data=order_data)
+        if serializer.is_valid():
+            valid_serializers.append(serializer)
+            results.append({"id": None})
+        else:
+            results.append({"errors": serializer.errors})
+
+    orders = create_orders(
+        [serializer.validated_data for serializer in valid_serializers]
+    )
+    created_results = (result for result in results if "errors" not in result)
+    for result, order in zip(created_results, orders):
+        result["id"] = order.id
+
+    return Response(data=results, status=status.HTTP_200_OK)
@@ -1,8 +1,31 @@
 from django.contrib import admin
 
-from locations.models import Location
+from locations.models import GeocodingTask, Location, LocationDistance
 
 # Register your models here.
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(GeocodingTask)
+class GeocodingTaskAdmin(admin.ModelAdmin):
+    list_display = [
+        "location",
+        "attempts",
+        "scheduled_at",
+        "last_error",
+    ]
+
+
+@admin.register(LocationDistance)
+class LocationDistanceAdmin(admin.ModelAdmin):
+    list_display = [
+        "origin",
+        "destination",
+        "distance",
+    ]
+    raw_id_fields = [
+        "origin",
+        "destination",
+    ]
@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.db.models import Q
+from geopy import distance
+
+from locations.models import LocationDistance
+
+EARTH_RADIUS_KM = 6371.0088
+DISTANCE_CACHE_SIZE = 100000
+
+
+def get_distance_matrix(origins, destinations):
+    # Haversine distances in km between every origin and every destination,
+    # both given as sequences of (latitude, longitude) pairs.
+    origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+
+    origin_lat = origins[:, 0, np.newaxis]
+    origin_lon = origins[:, 1, np.newaxis]
+    destination_lat = destinations[np.newaxis, :, 0]
+    destination_lon = destinations[np.newaxis, :, 1]
+
+    haversine = (
+        np.sin((destination_lat - origin_lat) / 2) ** 2
+        + np.cos(origin_lat)
+        * np.cos(destination_lat)
+        * np.sin((destination_lon - origin_lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(haversine, 0, 1)))
+
+
+def get_exact_distance(origin, destination):
+    return distance.distance(origin, destination).km
+
+
+class DistanceCache:
+    # In-process LRU of distances keyed by the coordinates themselves,
+    # so entries never go stale when a location is geocoded again
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.distances = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            distance_km = self.distances.get(key)
+            if distance_km is not None:
+                self.distances.move_to_end(key)
+            return distance_km
+
+    def add(self, key, distance_km):
+        with self.lock:
+            self.distances[key] = distance_km
+            self.distances.move_to_end(key)
+            while len(self.distances) > self.max_size:
+                self.distances.popitem(last=False)
+
+
+distance_cache = DistanceCache(max_size=DISTANCE_CACHE_SIZE)
+
+
+def get_location_distances(location_pairs):
+    # {(origin id, destination id): km} for (origin, destination) `Location`
+    # pairs with known coordinates: from the in-process cache, then from the
+    # `LocationDistance` table, computing and storing only unknown distances.
+    # Haversine distances: see `get_exact_distance` for a geodesic.
+    location_pairs = {
+        (origin.id, destination.id): (origin.coordinates, destination.coordinates)
+        for origin, destination in location_pairs
+    }
+
+    distances = {}
+    for pair, coordinates in location_pairs.items():
+        distance_km = distance_cache.get(coordinates)
+        if distance_km is not None:
+            distances[pair] = distance_km
+    missing_pairs = location_pairs.keys() - distances.keys()
+    if not missing_pairs:
+        return distances
+
+    stored_distances = LocationDistance.objects.filter(
+        origin_id__in={origin_id for origin_id, _ in missing_pairs},
+        destination_id__in={destination_id for _, destination_id in missing_pairs},
+    ).values_list("origin_id", "destination_id", "distance")
+    for origin_id, destination_id, distance_km in stored_distances:
+        pair = (origin_id, destination_id)
+        if pair in missing_pairs:
+            distances[pair] = distance_km
+            distance_cache.add(location_pairs[pair], distance_km)
+
+    # The remaining pairs in a single haversine pass
+    missing_pairs = list(missing_pairs - distances.keys())
+    origins = list({location_pairs[pair][0] for pair in missing_pairs})
+    destinations = list({location_pairs[pair][1] for pair in missing_pairs})
+    origin_rows = {coordinates: row for row, coordinates in enumerate(origins)}
+    destination_columns = {
+        coordinates: column for column, coordinates in enumerate(destinations)
+    }
+    distance_matrix = get_distance_matrix(origins, destinations)
+
+    new_distances = []
+    for pair in missing_pairs:
+        origin, destination = location_pairs[pair]
+        distance_km = float(
+            distance_matrix[origin_rows[origin], destination_columns[destination]]
+        )
+        distances[pair] = distance_km
+        distance_cache.add(location_pairs[pair], distance_km)
+        new_distances.append(
+            LocationDistance(
+                origin_id=pair[0], destination_id=pair[1], distance=distance_km
+            )
+        )
+    LocationDistance.objects.bulk_create(
+        new_distances, batch_size=500, ignore_conflicts=True
+    )
+    return distances
+
+
+def forget_location_distances(location_ids):
+    # Call when locations get new coordinates
+    LocationDistance.objects.filter(
+        Q(origin_id__in=location_ids) | Q(destination_id__in=location_ids)
+    ).delete()
@@ -1,23 +1,543 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+
+import httpx
 import requests
+import requests.adapters
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
 
+from locations.distances import forget_location_distances
+from locations.models import GeocodingTask, Location
+from locations.signals import announce_moved_locations
+from star_burger.metrics import track_geocoder_call
 
-def fetch_coordinates(address: str):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(
-        base_url,
-        params={
+YANDEX_GEOCODER_URL = "https://geocode-maps.yandex.ru/1.x"
+GEOCODER_POOL_SIZE = 10
+GEOCODER_ASYNC_POOL_SIZE = 100
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Not worth retrying, but the geocoder cannot serve us either
+REJECT_STATUSES = {401, 403}
+COORDINATES_PRECISION = Decimal("0.001")
+GEOCODING_MAX_ATTEMPTS = 8
+GEOCODING_RETRY_BASE_DELAY = timedelta(seconds=30)
+GEOCODING_RETRY_MAX_DELAY = timedelta(hours=1)
+GEOCODING_TASK_LEASE = timedelta(minutes=5)
+
+geocoding_cache = ConnectionProxy(caches, "geocoding")
+
+
+class GeocoderUnavailable(requests.RequestException):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` failures in a row and rejects calls for
+    # `recovery_time` seconds, then lets a single trial call through.
+
+    def __init__(self, failure_threshold, recovery_time):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures_count = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.recovery_time:
+                # Half-open: postpone other calls until the trial one finishes
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures_count = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures_count += 1
+            if self.failures_count >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class YandexGeocoder:
+    # Keeps connections to the geocoder alive between calls, retries
+    # network errors and 429/5xx responses with jittered exponential backoff
+    # and stops calling the geocoder for a while when it keeps failing,
+    # rejected API keys (401/403) included.
+    # `fetch_coordinates_async` does the same for async views.
+
+    def __init__(
+        self,
+        apikey,
+        base_url=YANDEX_GEOCODER_URL,
+        connect_timeout=3.05,
+        read_timeout=10,
+        max_retries=2,
+        retry_delay=0.5,
+        circuit_breaker=None,
+    ):
+        self.apikey = apikey
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.async_timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(
+            failure_threshold=5, recovery_time=30
+        )
+        self.session = requests.Session()
+        self.session.mount(
+            "https://", requests.adapters.HTTPAdapter(pool_maxsize=GEOCODER_POOL_SIZE)
+        )
+        self.session.mount(
+            "http://", requests.adapters.HTTPAdapter(pool_maxsize=GEOCODER_POOL_SIZE)
+        )
+        # {event loop: httpx client}: a client can only be used in the loop
+        # it was created in, and is dropped together with its loop
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def get_retry_delay(self, attempt):
+        return random.uniform(0, self.retry_delay * 2**attempt)
+
+    def request(self, params):
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow_call():
+                raise GeocoderUnavailable("Геокодер временно недоступен")
+            try:
+                with track_geocoder_call():
+                    response = self.session.get(
+                        self.base_url, params=params, timeout=self.timeout
+                    )
+                response.raise_for_status()
+            except requests.RequestException as error:
+                status = (
+                    error.response.status_code if error.response is not None else None
+                )
+                if (
+                    status is not None
+                    and status not in RETRY_STATUSES | REJECT_STATUSES
+                ):
+                    # The request itself is wrong, the geocoder is fine
+                    self.circuit_breaker.record_success()
+                    raise
+                self.circuit_breaker.record_failure()
+                if attempt == self.max_retries or status in REJECT_STATUSES:
+                    raise
+                time.sleep(self.get_retry_delay(attempt))
+            else:
+                self.circuit_breaker.record_success()
+                return response.json()
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_clients:
+            self.async_clients[loop] = httpx.AsyncClient(
+                timeout=self.async_timeout,
+                limits=httpx.Limits(max_connections=GEOCODER_ASYNC_POOL_SIZE),
+            )
+        return self.async_clients[loop]
+
+    async def close_async_client(self):
+        # Call before a short-lived event loop, as in `asyncio.run`, finishes
+        client = self.async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def request_async(self, params):
+        client = self.get_async_client()
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow_call():
+                raise GeocoderUnavailable("Геокодер временно недоступен")
+            try:
+                with track_geocoder_call():
+                    response = await client.get(self.base_url, params=params)
+                response.raise_for_status()
+            except httpx.HTTPError as error:
+                # Reraised as `requests` errors, which the callers already handle
+                status = None
+                if isinstance(error, httpx.HTTPStatusError):
+                    status = error.response.status_code
+                if (
+                    status is not None
+                    and status not in RETRY_STATUSES | REJECT_STATUSES
+                ):
+                    self.circuit_breaker.record_success()
+                    raise requests.HTTPError(str(error)) from error
+                self.circuit_breaker.record_failure()
+                if status in REJECT_STATUSES:
+                    raise requests.HTTPError(str(error)) from error
+                if attempt == self.max_retries:
+                    raise requests.RequestException(str(error)) from error
+                await asyncio.sleep(self.get_retry_delay(attempt))
+            else:
+                self.circuit_breaker.record_success()
+                return response.json()
+
+    def get_params(self, address):
+        return {
             "geocode": address,
-            "apikey": settings.YANDEX_APIKEY,
+            "apikey": self.apikey,
             "format": "json",
+        }
+
+    @staticmethod
+    def parse_response(response):
+        found_places = response["response"]["GeoObjectCollection"]["featureMember"]
+
+        if not found_places:
+            return None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant["GeoObject"]["Point"]["pos"].split(" ")
+        return lat, lon
+
+    def fetch_coordinates(self, address: str):
+        return self.parse_response(self.request(self.get_params(address)))
+
+    async def fetch_coordinates_async(self, address: str):
+        return self.parse_response(await self.request_async(self.get_params(address)))
+
+
+geocoder = YandexGeocoder(
+    apikey=settings.YANDEX_APIKEY,
+    base_url=settings.GEOCODER_URL,
+    connect_timeout=settings.GEOCODER_CONNECT_TIMEOUT,
+    read_timeout=settings.GEOCODER_READ_TIMEOUT,
+    max_retries=settings.GEOCODER_MAX_RETRIES,
+    circuit_breaker=CircuitBreaker(
+        failure_threshold=settings.GEOCODER_CIRCUIT_BREAKER_FAILURES,
+        recovery_time=settings.GEOCODER_CIRCUIT_BREAKER_RECOVERY_TIME,
+    ),
+)
+
+
+def fetch_coordinates(address: str):
+    return geocoder.fetch_coordinates(address)
+
+
+async def fetch_coordinates_async(address: str):
+    return await geocoder.fetch_coordinates_async(address)
+
+
+async def close_async_client():
+    await geocoder.close_async_client()
+
+
+def normalize_address(address: str):
+    return " ".join(address.split())
+
+
+def parse_coordinates(coordinates):
+    if not coordinates:
+        return None, None
+    return tuple(
+        Decimal(coordinate).quantize(COORDINATES_PRECISION)
+        for coordinate in coordinates
+    )
+
+
+class RateLimiter:
+    # Spaces out calls made from several threads to at most `rate` per second
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_call_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call_at - now
+            self.next_call_at = max(now, self.next_call_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LocationCache:
+    # In-process LRU of recently resolved locations, keyed by normalized address,
+    # in front of the geocoding cache shared by all processes
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.locations = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(address):
+        return "location:" + hashlib.sha1(address.encode()).hexdigest()
+
+    @staticmethod
+    def get_fields(location):
+        return {
+            "id": location.id,
+            "address": location.address,
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+            "requested_at": location.requested_at,
+        }
+
+    def remember(self, address, fields):
+        with self.lock:
+            self.locations[address] = fields
+            self.locations.move_to_end(address)
+            while len(self.locations) > self.max_size:
+                self.locations.popitem(last=False)
+
+    def get_many(self, addresses):
+        fields_by_address = {}
+        with self.lock:
+            for address in addresses:
+                fields = self.locations.get(address)
+                if fields is not None:
+                    self.locations.move_to_end(address)
+                    fields_by_address[address] = fields
+
+        missing_keys = {
+            self.get_key(address): address
+            for address in addresses
+            if address not in fields_by_address
+        }
+        if missing_keys:
+            shared_fields = geocoding_cache.get_many(missing_keys.keys())
+            for key, fields in shared_fields.items():
+                self.remember(missing_keys[key], fields)
+                fields_by_address[missing_keys[key]] = fields
+
+        return {
+            address: Location(**fields) for address, fields in fields_by_address.items()
+        }
+
+    def get(self, address):
+        return self.get_many([address]).get(address)
+
+    def add_many(self, locations):
+        shared_fields = {}
+        for location in locations:
+            fields = self.get_fields(location)
+            self.remember(location.address, fields)
+            shared_fields[self.get_key(location.address)] = fields
+        geocoding_cache.set_many(
+            shared_fields,
+            timeout=settings.GEOCODER_CACHE_TTL.total_seconds(),
+        )
+
+    def add(self, location):
+        self.add_many([location])
+
+
+location_cache = LocationCache(max_size=settings.GEOCODER_CACHE_SIZE)
+
+
+def is_fresh(location):
+    if location.requested_at is None:
+        return False
+    if location.coordinates:
+        ttl = settings.GEOCODER_CACHE_TTL
+    else:
+        ttl = settings.GEOCODER_NEGATIVE_CACHE_TTL
+    return location.requested_at + ttl > timezone.now()
+
+
+def find_location(address: str):
+    # Look an address up in the in-process cache and in the DB
+    # without asking the geocoder.
+    address = normalize_address(address)
+
+    location = location_cache.get(address)
+    if location is None or not is_fresh(location):
+        location = Location.objects.filter(address=address).first()
+    if location and is_fresh(location):
+        location_cache.add(location)
+    return location
+
+
+def geocode_address(address: str):
+    latitude, longitude = parse_coordinates(fetch_coordinates(address))
+    location, created = Location.objects.update_or_create(
+        address=address,
+        defaults={
+            "latitude": latitude,
+            "longitude": longitude,
+            "requested_at": timezone.now(),
         },
     )
-    response.raise_for_status()
-    found_places = response.json()["response"]["GeoObjectCollection"]["featureMember"]
+    GeocodingTask.objects.filter(location=location).delete()
+    location_cache.add(location)
+    return location
+
+
+async def get_location_async(address: str):
+    # Resolve an address to a `Location`, looking it up in the in-process
+    # cache and in the DB before asking the geocoder. Addresses the geocoder
+    # could not find are stored without coordinates (negative caching).
+    # The geocoder is awaited and the DB is queried from a worker thread.
+    location = await sync_to_async(find_location)(address)
+    if location and is_fresh(location):
+        return location
+
+    address = normalize_address(address)
+    try:
+        coordinates = await fetch_coordinates_async(address)
+    except requests.RequestException:
+        if location:
+            return location
+        raise
+    locations = await sync_to_async(save_geocoded_locations)({address: coordinates})
+    return locations[address]
+
+
+def save_geocoded_locations(coordinates_by_address):
+    # Bulk counterpart of `geocode_address` for already fetched
+    # {normalized address: coordinates} results.
+    now = timezone.now()
+    locations = Location.objects.in_bulk(
+        coordinates_by_address.keys(), field_name="address"
+    )
+    new_locations = []
+    moved_location_ids = set()
+    for address, coordinates in coordinates_by_address.items():
+        location = locations.get(address) or Location(address=address)
+        previous_coordinates = (location.latitude, location.longitude)
+        location.latitude, location.longitude = parse_coordinates(coordinates)
+        location.requested_at = now
+        if location.pk is None:
+            new_locations.append(location)
+        elif previous_coordinates != (location.latitude, location.longitude):
+            moved_location_ids.add(location.pk)
+
+    with transaction.atomic():
+        Location.objects.bulk_update(
+            list(locations.values()),
+            ["latitude", "longitude", "requested_at"],
+            batch_size=500,
+        )
+        Location.objects.bulk_create(
+            new_locations, batch_size=500, ignore_conflicts=True
+        )
+        GeocodingTask.objects.filter(location__in=locations.values()).delete()
+        forget_location_distances(moved_location_ids)
+        if moved_location_ids:
+            # Located at last or moved: their orders need candidates
+            # again, like after a single save
+            announce_moved_locations(
+                [
+                    location
+                    for location in locations.values()
+                    if location.pk in moved_location_ids
+                ]
+            )
+
+    locations = Location.objects.in_bulk(
+        coordinates_by_address.keys(), field_name="address"
+    )
+    location_cache.add_many(locations.values())
+    return locations
+
+
+def request_locations(addresses):
+    # Return {normalized address: Location} without waiting for the geocoder:
+    # unknown and outdated addresses are queued for the geocoding worker.
+    addresses = {normalize_address(address) for address in addresses}
+
+    locations = {
+        address: location
+        for address, location in location_cache.get_many(addresses).items()
+        if is_fresh(location)
+    }
+    missing_addresses = addresses - locations.keys()
+    if not missing_addresses:
+        return locations
+
+    stored_locations = Location.objects.in_bulk(missing_addresses, field_name="address")
+    Location.objects.bulk_create(
+        [
+            Location(address=address, requested_at=None)
+            for address in missing_addresses - stored_locations.keys()
+        ],
+        ignore_conflicts=True,
+    )
+    stored_locations = Location.objects.in_bulk(missing_addresses, field_name="address")
+    stale_locations = [
+        location for location in stored_locations.values() if not is_fresh(location)
+    ]
+    GeocodingTask.objects.bulk_create(
+        [GeocodingTask(location=location) for location in stale_locations],
+        ignore_conflicts=True,
+    )
+    # The address is ordered again: give up on it no longer
+    GeocodingTask.objects.filter(
+        location__in=stale_locations, attempts__gte=GEOCODING_MAX_ATTEMPTS
+    ).update(attempts=0, scheduled_at=timezone.now())
+    location_cache.add_many(
+        location for location in stored_locations.values() if is_fresh(location)
+    )
+
+    return {**locations, **stored_locations}
+
+
+def request_location(address: str):
+    return request_locations([address])[normalize_address(address)]
+
+
+def get_retry_delay(attempts):
+    return min(
+        GEOCODING_RETRY_BASE_DELAY * 2 ** (attempts - 1),
+        GEOCODING_RETRY_MAX_DELAY,
+    )
+
+
+def claim_geocoding_tasks(batch_size):
+    # Lease due tasks to this worker by pushing their schedule forward,
+    # so that concurrent workers do not pick the same tasks.
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            GeocodingTask.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("location")
+            .filter(scheduled_at__lte=now, attempts__lt=GEOCODING_MAX_ATTEMPTS)
+            .order_by("scheduled_at")[:batch_size]
+        )
+        GeocodingTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            scheduled_at=now + GEOCODING_TASK_LEASE
+        )
+    return tasks
 
-    if not found_places:
-        return None
 
-    most_relevant = found_places[0]
-    lon, lat = most_relevant["GeoObject"]["Point"]["pos"].split(" ")
-    return lat, lon
+def process_geocoding_tasks(batch_size=100):
+    tasks = claim_geocoding_tasks(batch_size)
+    for index, task in enumerate(tasks):
+        try:
+            geocode_address(task.location.address)
+        except GeocoderUnavailable:
+            # The circuit breaker is open and the geocoder was not asked:
+            # release the rest of the batch without counting an attempt.
+            GeocodingTask.objects.filter(
+                pk__in=[released.pk for released in tasks[index:]]
+            ).update(scheduled_at=timezone.now() + GEOCODING_RETRY_BASE_DELAY)
+            break
+        except Exception as error:
+            # Any failure, a malformed geocoder response included, counts
+            # as an attempt: otherwise the task would crash the worker again
+            # as soon as its lease expires.
+            GeocodingTask.objects.filter(pk=task.pk).update(
+                attempts=task.attempts + 1,
+                scheduled_at=timezone.now() + get_retry_delay(task.attempts + 1),
+                last_error=f"{type(error).__name__}: {error}",
+            )
+    return tasks
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from locations.geocoding import process_geocoding_tasks
+
+
+class Command(BaseCommand):
+    help = "Геокодирует адреса из очереди, повторяя неудачные запросы с задержкой"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="обработать очередь один раз и выйти",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="пауза между опросами пустой очереди, в секундах",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            tasks = process_geocoding_tasks(batch_size=options["batch_size"])
+            if tasks:
+                self.stdout.write(f"Обработано адресов: {len(tasks)}")
+            if options["once"]:
+                break
+            if len(tasks) < options["batch_size"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.4 on 2026-10-17 20:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0003_alter_location_requested_at_geocodingtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationDistance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField(verbose_name='расстояние, км')),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distances_to', to='locations.location', verbose_name='куда')),
+                ('origin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distances_from', to='locations.location', verbose_name='откуда')),
+            ],
+            options={
+                'verbose_name': 'расстояние',
+                'verbose_name_plural': 'расстояния',
+                'unique_together': {('origin', 'destination')},
+            },
+        ),
+    ]
@@ -35,6 +35,8 @@ class Location(models.Model):
     requested_at = models.DateTimeField(
         verbose_name="запрос координат осуществлен",
         default=timezone.now,
+        null=True,
+        blank=True,
     )
 
     class Meta:
@@ -43,3 +45,62 @@ class Location(models.Model):
 
     def __str__(self):
         return self.address
+
+    @property
+    def coordinates(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
+
+
+class GeocodingTask(models.Model):
+    location = models.OneToOneField(
+        to=Location,
+        verbose_name="локация",
+        on_delete=models.CASCADE,
+        related_name="geocoding_task",
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name="попыток",
+        default=0,
+    )
+    scheduled_at = models.DateTimeField(
+        verbose_name="следующая попытка",
+        default=timezone.now,
+        db_index=True,
+    )
+    last_error = models.TextField(
+        verbose_name="последняя ошибка",
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = "задача геокодирования"
+        verbose_name_plural = "задачи геокодирования"
+
+    def __str__(self):
+        return str(self.location)
+
+
+class LocationDistance(models.Model):
+    origin = models.ForeignKey(
+        to=Location,
+        verbose_name="откуда",
+        on_delete=models.CASCADE,
+        related_name="distances_from",
+    )
+    destination = models.ForeignKey(
+        to=Location,
+        verbose_name="куда",
+        on_delete=models.CASCADE,
+        related_name="distances_to",
+    )
+    distance = models.FloatField(verbose_name="расстояние, км")
+
+    class Meta:
+        verbose_name = "расстояние"
+        verbose_name_plural = "расстояния"
+        unique_together = [["origin", "destination"]]
+
+    def __str__(self):
+        return f"{self.origin} — {self.destination}"
@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from locations.distances import forget_location_distances
+from locations.models import Location
+from locations.spatial import restaurant_grid
+
+# Sent after locations are saved with new coordinates, with `locations`
+location_moved = Signal()
+
+
+def announce_moved_locations(locations):
+    # Also called by bulk saves, which send no model signals
+    location_moved.send(sender=Location, locations=locations)
+
+    restaurant_points = list(
+        Location.objects.filter(
+            pk__in=[location.pk for location in locations], restaurants__isnull=False
+        ).values_list("restaurants__id", "latitude", "longitude")
+    )
+
+    def update_grid():
+        for restaurant_id, latitude, longitude in restaurant_points:
+            coordinates = (latitude, longitude) if latitude is not None else None
+            restaurant_grid.update(restaurant_id, coordinates)
+
+    if restaurant_points:
+        transaction.on_commit(update_grid)
+
+
+@receiver(pre_save, sender=Location)
+def forget_outdated_distances(sender, instance, **kwargs):
+    previous_coordinates = (
+        Location.objects.filter(pk=instance.pk)
+        .values_list("latitude", "longitude")
+        .first()
+    )
+    instance._coordinates_changed = previous_coordinates != (
+        instance.latitude,
+        instance.longitude,
+    )
+    if previous_coordinates and instance._coordinates_changed:
+        forget_location_distances([instance.pk])
+
+
+@receiver(post_save, sender=Location)
+def update_restaurant_grid(sender, instance, **kwargs):
+    if instance._coordinates_changed:
+        announce_moved_locations([instance])
+
+
+@receiver(pre_delete, sender=Location)
+def remove_from_restaurant_grid(sender, instance, **kwargs):
+    restaurant_ids = list(instance.restaurants.values_list("id", flat=True))
+
+    def update_grid():
+        for restaurant_id in restaurant_ids:
+            restaurant_grid.update(restaurant_id, None)
+
+    if restaurant_ids:
+        transaction.on_commit(update_grid)
@@ -0,0 +1,138 @@
+import math
+import threading
+from collections import defaultdict
+
+from locations.distances import get_distance_matrix
+from locations.models import Location
+
+GRID_CELL_SIZE_KM = 2
+KM_PER_DEGREE = 111.32
+GRID_VERSION = "restaurant_grid"
+
+
+def get_grid_version(max_age=None):
+    # Shared by all processes, the assign_restaurants sweep included.
+    # Imported here: foodcartapp models use the grid.
+    from foodcartapp.models import SHARED_VERSION_TTL, CacheVersion
+
+    if max_age is None:
+        max_age = SHARED_VERSION_TTL
+    return CacheVersion.objects.get_version(GRID_VERSION, max_age)
+
+
+def bump_grid_version():
+    from foodcartapp.models import CacheVersion
+
+    return CacheVersion.objects.bump(GRID_VERSION)
+
+
+class RestaurantGrid:
+    # Uniform latitude/longitude grid over restaurant locations
+    # for "nearest restaurants within R km" queries.
+
+    def __init__(self, cell_size_km=GRID_CELL_SIZE_KM):
+        self.cell_size = cell_size_km / KM_PER_DEGREE
+        self.cells = defaultdict(set)
+        self.points = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get_cell(self, latitude, longitude):
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def _remove(self, restaurant_id):
+        point = self.points.pop(restaurant_id, None)
+        if point:
+            cell = self.get_cell(*point)
+            self.cells[cell].discard(restaurant_id)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def _add(self, restaurant_id, coordinates):
+        latitude, longitude = (float(coordinate) for coordinate in coordinates)
+        self.points[restaurant_id] = (latitude, longitude)
+        self.cells[self.get_cell(latitude, longitude)].add(restaurant_id)
+
+    def rebuild(self):
+        version = get_grid_version(max_age=0)
+        restaurant_locations = Location.objects.filter(
+            restaurants__isnull=False,
+            latitude__isnull=False,
+            longitude__isnull=False,
+        ).values_list("restaurants__id", "latitude", "longitude")
+
+        with self.lock:
+            self.cells.clear()
+            self.points.clear()
+            for restaurant_id, latitude, longitude in restaurant_locations:
+                self._add(restaurant_id, (latitude, longitude))
+            self.version = version
+
+    def refresh(self, max_age=None):
+        # Pick up changes made by other processes
+        if self.version != get_grid_version(max_age):
+            self.rebuild()
+
+    def update(self, restaurant_id, coordinates):
+        previous_version = get_grid_version(max_age=0)
+        version = bump_grid_version()
+        with self.lock:
+            self._remove(restaurant_id)
+            if coordinates:
+                self._add(restaurant_id, coordinates)
+            if self.version == previous_version:
+                self.version = version
+
+    def remove(self, restaurant_id):
+        self.update(restaurant_id, None)
+
+    def get_candidates(self, latitude, longitude, radius_km):
+        lat_cells = math.ceil(radius_km / KM_PER_DEGREE / self.cell_size)
+        lon_degrees = radius_km / (
+            KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+        )
+        lon_cells = math.ceil(lon_degrees / self.cell_size)
+        row, column = self.get_cell(latitude, longitude)
+
+        if (2 * lat_cells + 1) * (2 * lon_cells + 1) > len(self.cells):
+            cells = [
+                restaurant_ids
+                for (cell_row, cell_column), restaurant_ids in self.cells.items()
+                if abs(cell_row - row) <= lat_cells
+                and abs(cell_column - column) <= lon_cells
+            ]
+        else:
+            cells = [
+                self.cells.get((cell_row, cell_column), ())
+                for cell_row in range(row - lat_cells, row + lat_cells + 1)
+                for cell_column in range(column - lon_cells, column + lon_cells + 1)
+            ]
+        return [restaurant_id for cell in cells for restaurant_id in cell]
+
+    def find_nearest(self, coordinates, radius_km, limit=None):
+        # [(restaurant id, distance in km), ...] sorted by distance
+        self.refresh()
+        latitude, longitude = (float(coordinate) for coordinate in coordinates)
+
+        with self.lock:
+            candidates = self.get_candidates(latitude, longitude, radius_km)
+            candidate_points = [self.points[candidate] for candidate in candidates]
+        if not candidates:
+            return []
+
+        distances = get_distance_matrix([(latitude, longitude)], candidate_points)[0]
+        nearest = sorted(
+            (
+                (restaurant_id, float(restaurant_distance))
+                for restaurant_id, restaurant_distance in zip(candidates, distances)
+                if restaurant_distance <= radius_km
+            ),
+            key=lambda entry: entry[1],
+        )
+        return nearest[:limit]
+
+
+restaurant_grid = RestaurantGrid()
@@ -1,3 +1,324 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from locations.distances import (
+    distance_cache,
+    get_distance_matrix,
+    get_exact_distance,
+    get_location_distances,
+)
+from locations.geocoding import (
+    GEOCODING_MAX_ATTEMPTS,
+    GEOCODING_TASK_LEASE,
+    CircuitBreaker,
+    GeocoderUnavailable,
+    YandexGeocoder,
+    claim_geocoding_tasks,
+    find_location,
+    geocode_address,
+    is_fresh,
+    location_cache,
+    process_geocoding_tasks,
+    request_locations,
+)
+from locations.models import GeocodingTask, Location, LocationDistance
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.calls += 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = b"error"
+        if status == 200:
+            body = json.dumps(
+                {
+                    "response": {
+                        "GeoObjectCollection": {
+                            "featureMember": [
+                                {"GeoObject": {"Point": {"pos": "37.6 55.7"}}}
+                            ]
+                        }
+                    }
+                }
+            ).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class YandexGeocoderTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubGeocoderHandler)
+        self.server.calls = 0
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.circuit_breaker = CircuitBreaker(failure_threshold=3, recovery_time=60)
+        self.geocoder = YandexGeocoder(
+            apikey="key",
+            base_url=f"http://127.0.0.1:{self.server.server_port}/",
+            max_retries=2,
+            retry_delay=0,
+            circuit_breaker=self.circuit_breaker,
+        )
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [503, 502]
+        self.assertEqual(self.geocoder.fetch_coordinates("Москва"), ("55.7", "37.6"))
+        self.assertEqual(self.server.calls, 3)
+        self.assertEqual(self.circuit_breaker.failures_count, 0)
+
+    def test_gives_up_after_retries(self):
+        self.server.statuses = [503] * 3
+        with self.assertRaises(requests.HTTPError):
+            self.geocoder.fetch_coordinates("Москва")
+        self.assertEqual(self.server.calls, 3)
+        with self.assertRaises(GeocoderUnavailable):
+            self.geocoder.fetch_coordinates("Москва")
+        self.assertEqual(self.server.calls, 3)
+
+    def test_rejected_key_opens_circuit_breaker(self):
+        self.server.statuses = [403, 401, 403]
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                self.geocoder.fetch_coordinates("Москва")
+        self.assertEqual(self.server.calls, 3)
+        with self.assertRaises(GeocoderUnavailable):
+            self.geocoder.fetch_coordinates("Москва")
+        self.assertEqual(self.server.calls, 3)
+
+    def test_bad_request_keeps_circuit_breaker_closed(self):
+        self.server.statuses = [400, 400, 400]
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                self.geocoder.fetch_coordinates("Москва")
+        self.assertEqual(self.server.calls, 3)
+        self.assertEqual(self.circuit_breaker.failures_count, 0)
+
+    def test_async_gives_up_after_retries(self):
+        self.server.statuses = [429, 429, 429]
+
+        async def fetch():
+            with self.assertRaises(requests.RequestException):
+                await self.geocoder.fetch_coordinates_async("Москва")
+            with self.assertRaises(GeocoderUnavailable):
+                await self.geocoder.fetch_coordinates_async("Москва")
+            await self.geocoder.close_async_client()
+
+        asyncio.run(fetch())
+        self.assertEqual(self.server.calls, 3)
+
+    def test_async_rejected_key_is_not_retried(self):
+        self.server.statuses = [401]
+
+        async def fetch():
+            with self.assertRaises(requests.HTTPError):
+                await self.geocoder.fetch_coordinates_async("Москва")
+            await self.geocoder.close_async_client()
+
+        asyncio.run(fetch())
+        self.assertEqual(self.server.calls, 1)
+        self.assertEqual(self.circuit_breaker.failures_count, 1)
+
+
+class GeocodingTestCase(TestCase):
+    def setUp(self):
+        # The caches outlive the test transactions
+        location_cache.locations.clear()
+        caches["geocoding"].clear()
+        patcher = mock.patch(
+            "locations.geocoding.fetch_coordinates", return_value=("55.7", "37.6")
+        )
+        self.fetch_coordinates = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class LocationCacheTest(GeocodingTestCase):
+    def test_finds_geocoded_location_without_queries(self):
+        location = geocode_address("Москва, Тверская 1")
+        self.assertEqual(location.coordinates, (Decimal("55.700"), Decimal("37.600")))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(find_location("  Москва,   Тверская 1 ").id, location.id)
+        # Another process only has the shared cache
+        location_cache.locations.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(find_location("Москва, Тверская 1").id, location.id)
+        self.fetch_coordinates.assert_called_once_with("Москва, Тверская 1")
+
+    def test_caches_not_found_addresses(self):
+        self.fetch_coordinates.return_value = None
+        geocode_address("Нигде")
+        location = find_location("Нигде")
+        self.assertIsNone(location.coordinates)
+        self.assertTrue(is_fresh(location))
+
+    def test_outdated_location_is_not_fresh(self):
+        Location.objects.create(
+            address="Москва",
+            latitude=Decimal("1"),
+            longitude=Decimal("2"),
+            requested_at=timezone.now() - timedelta(days=365),
+        )
+        location = find_location("Москва")
+        self.assertEqual(location.coordinates, (Decimal("1.000"), Decimal("2.000")))
+        self.assertFalse(is_fresh(location))
+
+    def test_unknown_address(self):
+        self.assertIsNone(find_location("Нигде"))
+        self.fetch_coordinates.assert_not_called()
+
+
+class GeocodingQueueTest(GeocodingTestCase):
+    def test_queues_unknown_addresses_once(self):
+        geocode_address("Москва")
+        locations = request_locations(["Москва", "Тверь", " Тверь "])
+        self.assertEqual(set(locations), {"Москва", "Тверь"})
+        self.assertIsNone(locations["Тверь"].coordinates)
+        request_locations(["Тверь"])
+        self.assertEqual(
+            list(GeocodingTask.objects.values_list("location__address", flat=True)),
+            ["Тверь"],
+        )
+
+    def test_processes_tasks(self):
+        request_locations(["Тверь"])
+        self.assertEqual(len(process_geocoding_tasks()), 1)
+        location = Location.objects.get(address="Тверь")
+        self.assertEqual(location.coordinates, (Decimal("55.700"), Decimal("37.600")))
+        self.assertFalse(GeocodingTask.objects.exists())
+
+    def test_leases_claimed_tasks(self):
+        request_locations(["Тверь", "Псков"])
+        self.assertEqual(len(claim_geocoding_tasks(batch_size=1)), 1)
+        self.assertEqual(len(claim_geocoding_tasks(batch_size=10)), 1)
+        self.assertEqual(claim_geocoding_tasks(batch_size=10), [])
+        self.assertTrue(
+            all(
+                task.scheduled_at > timezone.now() + GEOCODING_TASK_LEASE / 2
+                for task in GeocodingTask.objects.all()
+            )
+        )
+
+    def test_retries_failed_tasks_later(self):
+        request_locations(["Тверь"])
+        for error in [requests.ConnectionError("нет связи"), KeyError("response")]:
+            self.fetch_coordinates.side_effect = error
+            GeocodingTask.objects.update(scheduled_at=timezone.now())
+            process_geocoding_tasks()
+
+        task = GeocodingTask.objects.get()
+        self.assertEqual(task.attempts, 2)
+        self.assertEqual(task.last_error, "KeyError: 'response'")
+        self.assertGreater(task.scheduled_at, timezone.now())
+        self.assertEqual(process_geocoding_tasks(), [])
+
+    def test_gives_up_after_max_attempts(self):
+        request_locations(["Тверь"])
+        GeocodingTask.objects.update(attempts=GEOCODING_MAX_ATTEMPTS)
+        self.assertEqual(process_geocoding_tasks(), [])
+        self.fetch_coordinates.assert_not_called()
+
+    def test_ordering_address_again_resumes_exhausted_task(self):
+        request_locations(["Тверь"])
+        GeocodingTask.objects.update(
+            attempts=GEOCODING_MAX_ATTEMPTS,
+            scheduled_at=timezone.now() + timedelta(hours=1),
+        )
+        request_locations(["Тверь"])
+        self.assertEqual(len(process_geocoding_tasks()), 1)
+        self.assertEqual(
+            Location.objects.get(address="Тверь").coordinates,
+            (Decimal("55.700"), Decimal("37.600")),
+        )
+
+    def test_open_circuit_breaker_is_not_an_attempt(self):
+        request_locations(["Тверь", "Псков"])
+        self.fetch_coordinates.side_effect = GeocoderUnavailable
+        self.assertEqual(len(process_geocoding_tasks()), 2)
+        self.assertEqual(self.fetch_coordinates.call_count, 1)
+        for task in GeocodingTask.objects.all():
+            self.assertEqual(task.attempts, 0)
+            self.assertGreater(task.scheduled_at, timezone.now())
+
+
+class DistanceMatrixTest(SimpleTestCase):
+    def test_close_to_geodesic(self):
+        origins = [(55.75, 37.62), (59.94, 30.31)]
+        destinations = [(55.80, 37.62), (55.75, 37.70), (59.94, 30.31)]
+        distance_matrix = get_distance_matrix(origins, destinations)
+        self.assertEqual(distance_matrix.shape, (2, 3))
+        for row, origin in enumerate(origins):
+            for column, destination in enumerate(destinations):
+                self.assertAlmostEqual(
+                    distance_matrix[row, column],
+                    get_exact_distance(origin, destination),
+                    delta=get_exact_distance(origin, destination) * 0.005,
+                )
+        self.assertEqual(distance_matrix[1, 2], 0)
+
+
+class LocationDistancesTest(TestCase):
+    def setUp(self):
+        # The cache outlives the test transactions
+        distance_cache.distances.clear()
+        self.origin = Location.objects.create(
+            address="Ближний", latitude=Decimal("55.750"), longitude=Decimal("37.620")
+        )
+        self.destinations = [
+            Location.objects.create(
+                address=address, latitude=latitude, longitude=Decimal("37.620")
+            )
+            for address, latitude in [
+                ("Дальний", Decimal("55.800")),
+                ("Самый дальний", Decimal("55.850")),
+            ]
+        ]
+        self.pairs = [(self.origin, destination) for destination in self.destinations]
+
+    def test_computes_and_stores_missing_distances(self):
+        distances = get_location_distances(self.pairs)
+        self.assertAlmostEqual(
+            distances[(self.origin.id, self.destinations[0].id)], 5.56, places=2
+        )
+        self.assertAlmostEqual(
+            distances[(self.origin.id, self.destinations[1].id)], 11.12, places=2
+        )
+        self.assertEqual(LocationDistance.objects.count(), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_location_distances(self.pairs), distances)
+        # Another process only has the table
+        distance_cache.distances.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_location_distances(self.pairs), distances)
+
+    def test_forgets_distances_of_moved_locations(self):
+        get_location_distances(self.pairs)
+        self.destinations[0].latitude = Decimal("55.750")
+        self.destinations[0].save()
+        self.assertEqual(
+            list(LocationDistance.objects.values_list("destination_id", flat=True)),
+            [self.destinations[1].id],
+        )
+
+        distances = get_location_distances(self.pairs)
+        self.assertEqual(distances[(self.origin.id, self.destinations[0].id)], 0)
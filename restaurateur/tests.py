@@ -1,3 +1,245 @@
-from django.test import TestCase
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase
+
+from foodcartapp.models import (
+    AVAILABILITY_VERSION,
+    CacheVersion,
+    Order,
+    Product,
+    Restaurant,
+    RestaurantMenuItem,
+    dashboard_cache,
+    read_versions,
+)
+from restaurateur import views
+from restaurateur.views import (
+    decode_orders_cursor,
+    encode_orders_cursor,
+    encode_stream_cursor,
+    generate_order_events,
+)
+
+
+class OrdersCursorTest(SimpleTestCase):
+    def test_round_trip(self):
+        order = Order(
+            id=42,
+            status=Order.COOKING,
+            registered_at=datetime(2022, 5, 5, 11, 21, 3, 123456, tzinfo=timezone.utc),
+        )
+        self.assertEqual(
+            decode_orders_cursor(encode_orders_cursor(order)),
+            (order.status, order.registered_at, order.id),
+        )
+
+    def test_malformed_cursor(self):
+        for cursor in ["", "1.2", "1.x.3", "1.2.3.4"]:
+            with self.assertRaises(ValueError):
+                decode_orders_cursor(cursor)
+
+
+class ViewOrdersTest(TestCase):
+    def setUp(self):
+        manager = User.objects.create_user("manager", is_staff=True)
+        self.client.force_login(manager)
+
+        registered_at = datetime(2022, 5, 5, 11, 21, tzinfo=timezone.utc)
+        for order_status in [Order.NEW, Order.COOKING, Order.NEW, Order.CONFIRMED]:
+            for _ in range(2):
+                # Orders registered at the same moment are told apart by id
+                Order.objects.create(
+                    first_name="Иван",
+                    last_name="Иванов",
+                    phone_number="+79161234567",
+                    address="Москва",
+                    status=order_status,
+                    registered_at=registered_at,
+                )
+        Order.objects.create(
+            first_name="Иван",
+            last_name="Иванов",
+            phone_number="+79161234567",
+            address="Москва",
+            status=Order.FINISHED,
+        )
+
+    @mock.patch("restaurateur.views.ORDERS_PER_PAGE", 3)
+    def test_pages(self):
+        order_ids = []
+        params = {}
+        while True:
+            response = self.client.get("/manager/orders/", params)
+            self.assertEqual(response.status_code, 200)
+            order_ids += [order.id for order in response.context["orders"]]
+            if not response.context["next_cursor"]:
+                break
+            params = {"after": response.context["next_cursor"]}
+
+        self.assertEqual(
+            order_ids,
+            list(
+                Order.objects.exclude(status=Order.FINISHED)
+                .order_by("status", "registered_at", "id")
+                .values_list("id", flat=True)
+            ),
+        )
+
+    def test_bad_cursor(self):
+        response = self.client.get("/manager/orders/", {"after": "1.2"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ViewProductsTest(TestCase):
+    def setUp(self):
+        read_versions.clear()
+        dashboard_cache.clear()
+        manager = User.objects.create_user("manager", is_staff=True)
+        self.client.force_login(manager)
+
+        self.restaurants = [
+            Restaurant.objects.create(name=name) for name in ["Арбат", "Тверь"]
+        ]
+        self.products = [
+            Product.objects.create(name=name, price=100, image=f"{name}.png")
+            for name in ["Бургер", "Картошка", "Кола"]
+        ]
+        menu = {
+            "Бургер": self.restaurants,
+            "Картошка": self.restaurants[:1],
+            "Кола": [],
+        }
+        for product in self.products:
+            for restaurant in menu[product.name]:
+                RestaurantMenuItem.objects.create(
+                    restaurant=restaurant, product=product
+                )
+
+    def get_matrix(self):
+        response = self.client.get("/manager/products/")
+        self.assertEqual(response.status_code, 200)
+        return {
+            product.name: [
+                cell_id
+                for cell_id in ["Capa_1", "Layer_1"]
+                for _ in range(cells.count(f'id="{cell_id}"'))
+            ]
+            for product, cells in response.context["products_with_restaurants"]
+        }
+
+    def test_renders_matrix(self):
+        self.assertEqual(
+            self.get_matrix(),
+            {
+                "Бургер": ["Capa_1", "Capa_1"],
+                "Картошка": ["Capa_1", "Layer_1"],
+                "Кола": ["Layer_1", "Layer_1"],
+            },
+        )
+
+    def test_renders_each_row_once(self):
+        self.get_matrix()
+        with mock.patch(
+            "restaurateur.views.render_to_string", wraps=views.render_to_string
+        ) as render_to_string:
+            self.get_matrix()
+        render_to_string.assert_not_called()
+
+    def test_updates_changed_rows(self):
+        self.get_matrix()
+        rows = RestaurantMenuItem.objects.get_availability_rows(
+            [product.id for product in self.products]
+        )
+        version = CacheVersion.objects.get(name=AVAILABILITY_VERSION).version
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item = RestaurantMenuItem.objects.get(
+                product=self.products[1], restaurant=self.restaurants[0]
+            )
+            menu_item.availability = False
+            menu_item.save()
+
+        updated_rows = RestaurantMenuItem.objects.get_availability_rows(
+            [product.id for product in self.products]
+        )
+        self.assertEqual(updated_rows[self.products[1].id], 0)
+        # Other rows stay in the cache
+        self.assertEqual(
+            CacheVersion.objects.get(name=AVAILABILITY_VERSION).version, version
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                RestaurantMenuItem.objects.get_availability_rows([self.products[0].id]),
+                {self.products[0].id: rows[self.products[0].id]},
+            )
+        self.assertEqual(self.get_matrix()["Картошка"], ["Layer_1", "Layer_1"])
+
+
+@mock.patch("restaurateur.views.time.sleep")
+class StreamOrdersTest(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", is_staff=True)
+        self.client.force_login(self.manager)
+        self.started_at = datetime.now(timezone.utc)
+        self.orders = [
+            Order.objects.create(
+                first_name="Иван",
+                last_name="Иванов",
+                phone_number="+79161234567",
+                address="Москва",
+                status=order_status,
+            )
+            for order_status in [Order.NEW, Order.FINISHED]
+        ]
+
+    def read_poll(self, events):
+        # Data of the order events sent by the next poll
+        orders = []
+        for event in events:
+            if event.startswith("event: order"):
+                orders.append(json.loads(event.split("data: ", 1)[1]))
+            elif event.startswith("id: "):
+                return orders
+
+    def test_streams_changed_orders(self, sleep):
+        Order.objects.filter(pk=self.orders[0].pk).update(
+            updated_at=self.started_at - timedelta(minutes=1)
+        )
+        response = self.client.get(
+            "/manager/orders/stream/",
+            {"since": encode_stream_cursor(self.started_at - timedelta(seconds=1))},
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = (chunk.decode() for chunk in response.streaming_content)
+        events = self.read_poll(events)
+        response.close()
+
+        self.assertEqual(
+            events, [{"id": self.orders[1].id, "status": Order.FINISHED, "html": None}]
+        )
+
+    def test_sends_each_change_once(self, sleep):
+        events = generate_order_events(
+            self.started_at - timedelta(seconds=1), [Order.NEW], next_url=""
+        )
+        first_poll = self.read_poll(events)
+        self.assertEqual(
+            [event["id"] for event in first_poll], [order.id for order in self.orders]
+        )
+        self.assertIn("Москва", first_poll[0]["html"])
+
+        self.orders[0].comment = "Позвонить заранее"
+        self.orders[0].save()
+        second_poll = self.read_poll(events)
+        self.assertEqual([event["id"] for event in second_poll], [self.orders[0].id])
+
+    def test_bad_cursor(self, sleep):
+        response = self.client.get("/manager/orders/stream/", {"since": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_refused_under_asgi(self, sleep):
+        request = AsyncRequestFactory().get("/manager/orders/stream/")
+        request.user = self.manager
+        self.assertEqual(views.stream_orders(request).status_code, 204)
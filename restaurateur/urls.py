@@ -11,6 +11,9 @@ urlpatterns = [
     path("restaurants/", views.view_restaurants, name="RestaurantView"),
     # TODO заглушка для нереализованного функционала
     path("orders/", views.view_orders, name="view_orders"),
+    path("orders/stream/", views.stream_orders, name="stream_orders"),
+    path("cache/", views.view_cache_stats, name="view_cache_stats"),
+    path("metrics/", views.view_metrics, name="view_metrics"),
     path("login/", views.LoginView.as_view(), name="login"),
     path("logout/", views.LogoutView.as_view(), name="logout"),
 ]
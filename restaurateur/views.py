@@ -1,14 +1,44 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
 from django import forms
+from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import user_passes_test
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import redirect, render
-from django.urls import reverse_lazy
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
+from django.utils.crypto import constant_time_compare
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.safestring import mark_safe
 from django.views import View
 
-from foodcartapp.models import Order, Product, Restaurant
-from locations.geocoding import fetch_coordinates
-from locations.models import Location
+from foodcartapp.models import (
+    Order,
+    Product,
+    Restaurant,
+    RestaurantMenuItem,
+    dashboard_cache,
+)
+from star_burger.metrics import metrics
+
+ORDERS_PER_PAGE = 50
+STREAM_POLL_INTERVAL = 2
+STREAM_SETTLE_TIME = timedelta(seconds=5)
+# The browser reconnects after that, so that a stream does not hold
+# a worker forever
+STREAM_DURATION = 60
+STREAM_RETRY_MS = 1000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+AVAILABILITY_CELLS_KEY = "menu:cells:{digest}"
+AVAILABILITY_CELLS_TIMEOUT = 24 * 60 * 60
 
 
 class Login(forms.Form):
@@ -67,27 +97,49 @@ def is_manager(user):
     return user.is_staff  # FIXME replace with specific permission
 
 
+def get_availability_cells(restaurants, rows):
+    # {availability row: rendered cells of the restaurant columns}. Products
+    # sold by the same restaurants share the markup, cached by the row
+    # and the columns, so a row is rendered once until the menus change.
+    columns = ",".join(str(restaurant.id) for restaurant in restaurants)
+    keys = {
+        AVAILABILITY_CELLS_KEY.format(
+            digest=hashlib.sha1(f"{columns}:{row}".encode()).hexdigest()
+        ): row
+        for row in set(rows)
+    }
+    cells = {keys[key]: html for key, html in dashboard_cache.get_many(keys).items()}
+
+    missing_cells = {
+        key: render_to_string(
+            "availability_cells.html",
+            {
+                "availability": [
+                    bool(row >> restaurant.id & 1) for restaurant in restaurants
+                ]
+            },
+        )
+        for key, row in keys.items()
+        if row not in cells
+    }
+    dashboard_cache.set_many(missing_cells, timeout=AVAILABILITY_CELLS_TIMEOUT)
+    cells.update((keys[key], html) for key, html in missing_cells.items())
+    return {row: mark_safe(html) for row, html in cells.items()}
+
+
 @user_passes_test(is_manager, login_url="restaurateur:login")
 def view_products(request):
     restaurants = list(Restaurant.objects.order_by("name"))
-    products = list(Product.objects.prefetch_related("menu_items", "category"))
-
-    default_availability = {restaurant.id: False for restaurant in restaurants}
-    products_with_restaurants = []
-    for product in products:
-
-        availability = {
-            **default_availability,
-            **{
-                item.restaurant_id: item.availability
-                for item in product.menu_items.all()
-            },
-        }
-        orderer_availability = [
-            availability[restaurant.id] for restaurant in restaurants
-        ]
+    products = list(Product.objects.select_related("category"))
+    availability_rows = RestaurantMenuItem.objects.get_availability_rows(
+        [product.id for product in products]
+    )
+    availability_cells = get_availability_cells(restaurants, availability_rows.values())
 
-        products_with_restaurants.append((product, orderer_availability))
+    products_with_restaurants = [
+        (product, availability_cells[availability_rows[product.id]])
+        for product in products
+    ]
 
     return render(
         request,
@@ -102,21 +154,6 @@ def view_products(request):
 @user_passes_test(is_manager, login_url="restaurateur:login")
 def view_restaurants(request):
     restaurants = Restaurant.objects.all()
-    restaurants_addresses = restaurants.values_list("address", flat=True)
-    restaurants_addresses_with_locations = Location.objects.filter(
-        address__in=restaurants_addresses
-    ).values_list("address", flat=True)
-
-    for address in restaurants_addresses:
-        if address not in restaurants_addresses_with_locations:
-            latitude, longitude = fetch_coordinates(address)
-            Location.objects.create(
-                address=address,
-                longitude=longitude,
-                latitude=latitude,
-            )
-        else:
-            continue
 
     return render(
         request,
@@ -127,17 +164,194 @@ def view_restaurants(request):
     )
 
 
+def encode_orders_cursor(order):
+    registered_at = order.registered_at - EPOCH
+    return f"{order.status}.{registered_at // timedelta(microseconds=1)}.{order.id}"
+
+
+def decode_orders_cursor(cursor):
+    status, registered_at, order_id = (int(part) for part in cursor.split("."))
+    return status, EPOCH + timedelta(microseconds=registered_at), order_id
+
+
+def get_selected_statuses(request):
+    return [
+        int(order_status)
+        for order_status in request.GET.getlist("status")
+        if order_status.isdigit()
+    ] or [
+        order_status
+        for order_status, _ in Order.STATUS_CHOICES
+        if order_status != Order.FINISHED
+    ]
+
+
+def encode_stream_cursor(moment):
+    return str((moment - EPOCH) // timedelta(microseconds=1))
+
+
+def decode_stream_cursor(cursor):
+    return EPOCH + timedelta(microseconds=int(cursor))
+
+
 @user_passes_test(is_manager, login_url="restaurateur:login")
 def view_orders(request):
-    orders = (
-        Order.objects.order_by("status")
-        .with_total_prices()
-        .with_restaurants()
-        .with_distances()
+    selected_statuses = get_selected_statuses(request)
+    stream_cursor = encode_stream_cursor(
+        datetime.now(timezone.utc) - STREAM_SETTLE_TIME
+    )
+    orders = Order.objects.filter(status__in=selected_statuses).order_by(
+        "status", "registered_at", "id"
     )
 
+    cursor = request.GET.get("after")
+    if cursor:
+        try:
+            orders = orders.after(*decode_orders_cursor(cursor))
+        except (ValueError, OverflowError):
+            return HttpResponseBadRequest("Некорректный курсор страницы")
+
+    orders = list(orders[: ORDERS_PER_PAGE + 1].with_candidates())
+    next_cursor = None
+    if len(orders) > ORDERS_PER_PAGE:
+        orders = orders[:ORDERS_PER_PAGE]
+        next_cursor = encode_orders_cursor(orders[-1])
+
     return render(
         request,
         template_name="order_items.html",
-        context={"orders": orders},
+        context={
+            "orders": orders,
+            "statuses": Order.STATUS_CHOICES,
+            "selected_statuses": selected_statuses,
+            "next_cursor": next_cursor,
+            "stream_cursor": stream_cursor,
+        },
+    )
+
+
+def format_event(event=None, data=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if data is not None:
+        lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def generate_order_events(cursor, selected_statuses, next_url):
+    # Orders changed since `cursor`: with a rendered table row if their status
+    # is shown on the dashboard and without one otherwise
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    sent_versions = {}
+    started_at = time.monotonic()
+    while time.monotonic() - started_at < STREAM_DURATION:
+        polled_at = datetime.now(timezone.utc)
+        changed_orders = [
+            (order_id, order_status, updated_at)
+            for order_id, order_status, updated_at in Order.objects.filter(
+                updated_at__gt=cursor
+            )
+            .order_by("updated_at", "id")
+            .values_list("id", "status", "updated_at")
+            if sent_versions.get(order_id) != updated_at
+        ]
+        shown_orders = Order.objects.filter(
+            id__in=[
+                order_id
+                for order_id, order_status, _ in changed_orders
+                if order_status in selected_statuses
+            ]
+        ).with_candidates()
+        shown_orders = {order.id: order for order in shown_orders}
+
+        for order_id, order_status, updated_at in changed_orders:
+            sent_versions[order_id] = updated_at
+            html = None
+            if order_id in shown_orders:
+                html = render_to_string(
+                    "order_row.html",
+                    {"order": shown_orders[order_id], "next_url": next_url},
+                )
+            yield format_event(
+                "order", {"id": order_id, "status": order_status, "html": html}
+            )
+
+        # Transactions committing late may still bring orders changed
+        # a moment ago, so recent changes are read again on the next poll
+        cursor = max(cursor, polled_at - STREAM_SETTLE_TIME)
+        sent_versions = {
+            order_id: updated_at
+            for order_id, updated_at in sent_versions.items()
+            if updated_at > cursor
+        }
+        yield format_event(event_id=encode_stream_cursor(cursor))
+        time.sleep(STREAM_POLL_INTERVAL)
+
+
+@user_passes_test(is_manager, login_url="restaurateur:login")
+def stream_orders(request):
+    if isinstance(request, ASGIRequest):
+        # Django iterates streaming responses inside the event loop, where
+        # the polling generator could neither query the database nor sleep.
+        # 204 tells the browser to stop reconnecting.
+        return HttpResponse(status=204)
+
+    cursor = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        cursor = decode_stream_cursor(cursor)
+    except (TypeError, ValueError, OverflowError):
+        return HttpResponseBadRequest("Некорректный курсор")
+
+    next_url = request.GET.get("next", "")
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts=None):
+        next_url = ""
+
+    response = StreamingHttpResponse(
+        generate_order_events(cursor, get_selected_statuses(request), next_url),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@user_passes_test(is_manager, login_url="restaurateur:login")
+def view_cache_stats(request):
+    cache_stats = []
+    for alias in settings.CACHES:
+        stats = caches[alias].get_stats()
+        requests_count = stats["hits"] + stats["misses"]
+        cache_stats.append(
+            {
+                "alias": alias,
+                "backend": settings.CACHES[alias]["BACKEND"].rsplit(".", 1)[-1],
+                **stats,
+                "hit_rate": stats["hits"] / requests_count if requests_count else None,
+            }
+        )
+
+    return render(
+        request,
+        template_name="cache_stats.html",
+        context={"cache_stats": cache_stats},
+    )
+
+
+def view_metrics(request):
+    # Open to managers and to a Prometheus scraper presenting METRICS_TOKEN
+    authorization = request.headers.get("Authorization", "")
+    has_token = settings.METRICS_TOKEN and constant_time_compare(
+        authorization, f"Bearer {settings.METRICS_TOKEN}"
+    )
+    if not has_token and not is_manager(request.user):
+        return redirect_to_login(
+            request.get_full_path(), login_url=reverse("restaurateur:login")
+        )
+
+    return HttpResponse(
+        metrics.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
     )
@@ -0,0 +1,94 @@
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache.backends import db, filebased, locmem, redis
+
+MISSING = object()
+
+
+class CacheStats:
+    # Hit/miss/eviction counters of one cache namespace in this process
+
+    def __init__(self):
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, counter, count=1):
+        if count:
+            with self.lock:
+                self.counters[counter] += count
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "hits": self.counters["hits"],
+                "misses": self.counters["misses"],
+                "evictions": self.counters["evictions"],
+            }
+
+
+# Backend instances are per thread, so the counters are kept by key prefix
+cache_stats = defaultdict(CacheStats)
+
+
+class StatsMixin:
+    counts_evictions = False
+
+    @property
+    def stats(self):
+        return cache_stats[self.key_prefix]
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        if not self.counts_evictions:
+            stats["evictions"] = None
+        return stats
+
+
+class GetStatsMixin(StatsMixin):
+    def get(self, key, default=None, version=None):
+        value = super().get(key, MISSING, version)
+        if value is MISSING:
+            self.stats.record("misses")
+            return default
+        self.stats.record("hits")
+        return value
+
+
+class GetManyStatsMixin(StatsMixin):
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        self.stats.record("hits", len(values))
+        self.stats.record("misses", len(keys) - len(values))
+        return values
+
+
+class LocMemCache(GetStatsMixin, locmem.LocMemCache):
+    counts_evictions = True
+
+    def _cull(self):
+        entries_count = len(self._cache)
+        super()._cull()
+        self.stats.record("evictions", entries_count - len(self._cache))
+
+
+class FileBasedCache(GetStatsMixin, filebased.FileBasedCache):
+    pass
+
+
+class DatabaseCache(GetManyStatsMixin, db.DatabaseCache):
+    # `get` goes through `get_many` here
+    pass
+
+
+class RedisCache(GetManyStatsMixin, GetStatsMixin, redis.RedisCache):
+    counts_evictions = True
+
+    def get_stats(self):
+        # Evictions are only known to the server; they are shared by
+        # every namespace and every process using it.
+        stats = super().get_stats()
+        server_stats = self._cache.get_client().info("stats")
+        stats["evictions"] = server_stats.get("evicted_keys", 0)
+        return stats
@@ -0,0 +1,49 @@
+from urllib.parse import parse_qsl, urlparse
+
+CACHE_BACKENDS = {
+    "locmem": "star_burger.cache_backends.LocMemCache",
+    "file": "star_burger.cache_backends.FileBasedCache",
+    "db": "star_burger.cache_backends.DatabaseCache",
+    "redis": "star_burger.cache_backends.RedisCache",
+    "rediss": "star_burger.cache_backends.RedisCache",
+}
+CACHE_NAMESPACES = ["catalog", "geocoding", "dashboard"]
+
+
+def parse_cache_url(url):
+    # locmem://, file:///var/tmp/star_burger, db://cache_table,
+    # redis://[:password@]host:port/db; query parameters go to OPTIONS
+    parsed_url = urlparse(url)
+    if parsed_url.scheme not in CACHE_BACKENDS:
+        raise ValueError(f"Unsupported cache URL scheme: {parsed_url.scheme}")
+
+    config = {"BACKEND": CACHE_BACKENDS[parsed_url.scheme]}
+    if parsed_url.scheme in ("redis", "rediss"):
+        config["LOCATION"] = parsed_url._replace(query="").geturl()
+    elif parsed_url.scheme == "file":
+        config["LOCATION"] = parsed_url.path
+    else:
+        config["LOCATION"] = parsed_url.netloc + parsed_url.path
+
+    options = dict(parse_qsl(parsed_url.query))
+    if "timeout" in options:
+        config["TIMEOUT"] = int(options.pop("timeout"))
+    for option in ("max_entries", "cull_frequency"):
+        if option in options:
+            options[option.upper()] = int(options.pop(option))
+    if options:
+        config["OPTIONS"] = options
+    return config
+
+
+def get_caches(url, key_prefix=""):
+    # The default cache plus one alias per namespace, sharing the same storage
+    # but keeping their keys apart.
+    config = parse_cache_url(url)
+    caches = {"default": {**config, "KEY_PREFIX": key_prefix}}
+    for namespace in CACHE_NAMESPACES:
+        caches[namespace] = {
+            **config,
+            "KEY_PREFIX": f"{key_prefix}:{namespace}" if key_prefix else namespace,
+        }
+    return caches
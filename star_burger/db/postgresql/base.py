@@ -0,0 +1,141 @@
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+
+class ConnectionPool:
+    # Up to `size` connections of a worker process, shared by its threads:
+    # returned connections stay open for the next thread to reuse them.
+
+    def __init__(self, size, conn_params):
+        self.size = size
+        self.conn_params = conn_params
+        self.idle_connections = []
+        self.connections_count = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        # None when all `size` connections are taken
+        while True:
+            with self.lock:
+                if self.idle_connections:
+                    connection = self.idle_connections.pop()
+                elif self.connections_count < self.size:
+                    connection = None
+                    self.connections_count += 1
+                else:
+                    return None
+
+            if connection is None:
+                try:
+                    return psycopg2.connect(**self.conn_params)
+                except psycopg2.Error:
+                    with self.lock:
+                        self.connections_count -= 1
+                    raise
+
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            except psycopg2.Error:
+                self.discard(connection)
+            else:
+                return connection
+
+    def put(self, connection):
+        if connection.closed:
+            self.discard(connection)
+            return
+        if (
+            connection.info.transaction_status
+            != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                self.discard(connection)
+                return
+        with self.lock:
+            self.idle_connections.append(connection)
+
+    def discard(self, connection):
+        connection.close()
+        with self.lock:
+            self.connections_count -= 1
+
+
+# {database alias: pool}
+pools = {}
+pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # PostgreSQL backend with two extra settings:
+    # CONN_HEALTH_CHECKS — check a persistent connection with `SELECT 1`
+    # before its first use in a request, as Django 4.1+ does;
+    # POOL_SIZE — keep up to that many connections open in the process
+    # and hand them over between threads instead of reconnecting.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pool = None
+
+    def get_pool(self, conn_params):
+        pool_size = self.settings_dict.get("POOL_SIZE")
+        if not pool_size:
+            return None
+        with pools_lock:
+            if self.alias not in pools:
+                pools[self.alias] = ConnectionPool(pool_size, conn_params)
+            return pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        connection = pool and pool.get()
+        if not connection:
+            self.pool = None
+            return super().get_new_connection(conn_params)
+
+        self.pool = pool
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = options.get(
+            "isolation_level", connection.isolation_level
+        )
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None and self.pool is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection)
+            self.pool = None
+            return
+        super()._close()
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and self.settings_dict.get("CONN_HEALTH_CHECKS")
+            and not self.health_check_done
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+NO_VIEW = "-"
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0
+        self.geocoder_calls = 0
+        self.geocoder_time = 0
+
+
+class Metrics:
+    # Request metrics by URL name. With PROMETHEUS_MULTIPROC_DIR set, every
+    # worker of a server writes its values to files in that directory and
+    # any worker renders the sum over all of them.
+
+    def __init__(self):
+        self.requests = Counter(
+            "http_requests", "Handled requests.", ["view", "method", "status"]
+        )
+        self.latency = Histogram(
+            "http_request_duration_seconds",
+            "Request latency.",
+            ["view"],
+            buckets=LATENCY_BUCKETS,
+        )
+        self.queries = Histogram(
+            "http_request_db_queries",
+            "DB queries made by a request.",
+            ["view"],
+            buckets=QUERIES_BUCKETS,
+        )
+        self.db_time = Counter(
+            "http_request_db_seconds", "Time spent in DB queries.", ["view"]
+        )
+        self.geocoder_calls = Counter(
+            "geocoder_requests", "Requests to the geocoder.", ["view"]
+        )
+        self.geocoder_time = Counter(
+            "geocoder_request_seconds",
+            "Time spent waiting for the geocoder.",
+            ["view"],
+        )
+
+    def record_request(self, view, method, status, latency, stats):
+        self.requests.labels(view, method, status).inc()
+        self.latency.labels(view).observe(latency)
+        self.queries.labels(view).observe(stats.queries)
+        self.db_time.labels(view).inc(stats.db_time)
+        self.geocoder_calls.labels(view).inc(stats.geocoder_calls)
+        self.geocoder_time.labels(view).inc(stats.geocoder_time)
+
+    def render(self):
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            return generate_latest(REGISTRY)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+
+metrics = Metrics()
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+
+@contextmanager
+def track_geocoder_call():
+    # Geocoder calls made outside of requests (management commands) are not counted
+    stats = current_request_stats.get()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.geocoder_calls += 1
+            stats.geocoder_time += time.perf_counter() - started_at
+
+
+def track_query(execute, sql, params, many, context):
+    stats = current_request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started_at
+
+
+@receiver(connection_created)
+def install_query_tracker(sender, connection, **kwargs):
+    # Installed on the connection itself rather than around the request:
+    # async views query the DB from worker threads with their own connections
+    if track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_query)
+
+
+def iterate_with_stats(iterator, stats):
+    # Generators run in the context of whoever iterates them, so the stats
+    # are set around each step rather than once
+    iterator = iter(iterator)
+    while True:
+        token = current_request_stats.set(stats)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            current_request_stats.reset(token)
+        yield chunk
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Lets Django call the middleware without switching to a thread
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        return self.track_response(request, response, started_at, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        return self.track_response(request, response, started_at, stats)
+
+    def track_response(self, request, response, started_at, stats):
+        if response.streaming:
+            # Recorded once the body is sent, with the queries made meanwhile
+            response.streaming_content = self.track_streaming_content(
+                response.streaming_content, request, response, started_at, stats
+            )
+        else:
+            self.record_request(request, response, started_at, stats)
+        return response
+
+    def track_streaming_content(self, content, request, response, started_at, stats):
+        try:
+            yield from iterate_with_stats(content, stats)
+        finally:
+            self.record_request(request, response, started_at, stats)
+
+    def record_request(self, request, response, started_at, stats):
+        resolver_match = request.resolver_match
+        metrics.record_request(
+            view=resolver_match and resolver_match.url_name or NO_VIEW,
+            method=request.method,
+            status=response.status_code,
+            latency=time.perf_counter() - started_at,
+            stats=stats,
+        )
@@ -1,9 +1,12 @@
 import os
+from datetime import timedelta
 
 import dj_database_url
 import rollbar
 from dotenv import load_dotenv
 
+from star_burger.cache_url import get_caches
+
 load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -12,7 +15,40 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 SECRET_KEY = os.getenv("SECRET_KEY")
 DEBUG = os.getenv("DEBUG", default="False").lower() == "true"
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", default="0"))
+DATABASE_CONN_HEALTH_CHECKS = (
+    os.getenv("DATABASE_CONN_HEALTH_CHECKS", default="False").lower() == "true"
+)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", default="0"))
+CACHE_URL = os.getenv("CACHE_URL", default="locmem://")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", default="")
 YANDEX_APIKEY = os.getenv("YANDEX_APIKEY")
+GEOCODER_URL = os.getenv("GEOCODER_URL", default="https://geocode-maps.yandex.ru/1.x")
+GEOCODER_CONNECT_TIMEOUT = float(os.getenv("GEOCODER_CONNECT_TIMEOUT", default="3.05"))
+GEOCODER_READ_TIMEOUT = float(os.getenv("GEOCODER_READ_TIMEOUT", default="10"))
+GEOCODER_MAX_RETRIES = int(os.getenv("GEOCODER_MAX_RETRIES", default="2"))
+GEOCODER_CIRCUIT_BREAKER_FAILURES = int(
+    os.getenv("GEOCODER_CIRCUIT_BREAKER_FAILURES", default="5")
+)
+GEOCODER_CIRCUIT_BREAKER_RECOVERY_TIME = int(
+    os.getenv("GEOCODER_CIRCUIT_BREAKER_RECOVERY_TIME", default="30")
+)
+GEOCODER_CACHE_SIZE = int(os.getenv("GEOCODER_CACHE_SIZE", default="1024"))
+GEOCODER_CACHE_TTL = timedelta(
+    days=int(os.getenv("GEOCODER_CACHE_TTL_DAYS", default="30"))
+)
+GEOCODER_NEGATIVE_CACHE_TTL = timedelta(
+    hours=int(os.getenv("GEOCODER_NEGATIVE_CACHE_TTL_HOURS", default="24"))
+)
+RESTAURANT_SEARCH_RADIUS_KM = (
+    float(os.getenv("RESTAURANT_SEARCH_RADIUS_KM"))
+    if os.getenv("RESTAURANT_SEARCH_RADIUS_KM")
+    else None
+)
+ASSIGNMENT_LOAD_PENALTY_KM = float(os.getenv("ASSIGNMENT_LOAD_PENALTY_KM", default="1"))
+ASYNC_ORDER_INTAKE = os.getenv("ASYNC_ORDER_INTAKE", default="False").lower() == "true"
+ORDER_GEOCODING_TIMEOUT = float(os.getenv("ORDER_GEOCODING_TIMEOUT", default="2"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", default="")
 ROLLBAR_TOKEN = os.getenv("ROLLBAR_TOKEN", default="")
 ROLLBAR_ENVIRONMENT = os.getenv("ROLLBAR_ENVIRONMENT", default="development")
 
@@ -40,12 +76,12 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
-    "debug_toolbar",
     "phonenumber_field",
     "rest_framework",
 ]
 
 MIDDLEWARE = [
+    "star_burger.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -53,9 +89,13 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     "rollbar.contrib.django.middleware.RollbarNotifierMiddlewareExcluding404",
 ]
+if DEBUG:
+    # The toolbar middleware is sync-only: under ASGI it would run every
+    # request in a worker thread, so it is not installed in production
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(-1, "debug_toolbar.middleware.DebugToolbarMiddleware")
 
 ROOT_URLCONF = "star_burger.urls"
 
@@ -98,8 +138,21 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
 
 DATABASES = {
-    "default": dj_database_url.config(default=DATABASE_URL),
+    "default": dj_database_url.config(
+        default=DATABASE_URL,
+        conn_max_age=DATABASE_CONN_MAX_AGE,
+    ),
 }
+if DATABASES["default"].get("ENGINE") == "django.db.backends.postgresql_psycopg2":
+    DATABASES["default"].update(
+        {
+            "ENGINE": "star_burger.db.postgresql",
+            "CONN_HEALTH_CHECKS": DATABASE_CONN_HEALTH_CHECKS,
+            "POOL_SIZE": DATABASE_POOL_SIZE,
+        }
+    )
+
+CACHES = get_caches(CACHE_URL, key_prefix=CACHE_KEY_PREFIX)
 
 AUTH_PASSWORD_VALIDATORS = [
     {